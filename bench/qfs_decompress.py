@@ -0,0 +1,131 @@
+'''compares the throughput of the QFS decompressor against the old
+byte-by-byte implementation
+
+usage: python bench/qfs_decompress.py [package.dat ...]
+
+without arguments a synthetic stream with long overlapping back-references
+is used, otherwise all compressed entries of the given packages.
+'''
+import sys
+import os.path
+from time import time
+from struct import unpack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from simtools import qfs
+from simtools.ext import qfs as native
+
+
+def legacy_decompress(data):
+    '''the decompressor as it was before the bytearray engine'''
+    header = unpack('<IH3B', data[:9])
+    pos = 9
+    length = header[0] - 9
+    size = header[2] << 16 | header[3] << 8 | header[4]
+    result = ''
+    
+    while length > 0 and len(result) < size:
+        opcode = ord(data[pos])
+        if opcode < 0x80:
+            byte1 = ord(data[pos+1])
+            numplain = opcode & 0x03
+            numcopy = ((opcode & 0x1c) >> 2) + 3
+            offset = ((opcode & 0x60) << 3) + byte1 + 1
+            skip = 2
+        elif opcode < 0xc0:
+            byte1, byte2 = ord(data[pos+1]), ord(data[pos+2])
+            numplain = ((byte1 & 0xc0) >> 6)
+            numcopy = (opcode & 0x3f) + 4
+            offset = ((byte1 & 0x3f) << 8) + byte2 + 1
+            skip = 3
+        elif opcode < 0xe0:
+            byte1, byte2, byte3 = ord(data[pos+1]), ord(data[pos+2]), ord(data[pos+3])
+            numplain = opcode & 0x03
+            numcopy = ((opcode & 0x0c) << 6) + byte3 + 5
+            offset = ((opcode & 0x10) << 12) + (byte1 << 8) + byte2 + 1
+            skip = 4
+        elif opcode < 0xfc:
+            numplain = ((opcode & 0x1f) << 2) + 4
+            numcopy = 0
+            skip = 1
+        else:
+            numplain = opcode & 0x03
+            numcopy = 0
+            skip = 1
+        
+        pos += skip
+        length -= skip
+        
+        if numplain:
+            result += data[pos:pos+numplain]
+            pos += numplain
+            length -= numplain
+        
+        if numcopy:
+            fromoffset = len(result) - offset
+            for i in xrange(numcopy):
+                result += result[fromoffset+i]
+    
+    return result
+
+
+def synthetic():
+    chunks = []
+    for i in xrange(2000):
+        chunks.append(''.join(chr((i * 7 + j) & 0xff) for j in xrange(64)))
+        chunks.append(chr(i & 0xff) * 300)
+    return [qfs.compress(''.join(chunks))]
+
+
+def from_packages(paths):
+    from simtools import DBPF
+    
+    streams = []
+    for path in paths:
+        with DBPF.open(path) as package:
+            for index in package:
+                if index.compressed:
+                    streams.append(index._read())
+    return streams
+
+
+def uncompressed_size(stream):
+    header = unpack('<IH3B', stream[:9])
+    return header[2] << 16 | header[3] << 8 | header[4]
+
+
+def measure(name, function, streams, size):
+    start = time()
+    for stream in streams:
+        function(stream)
+    elapsed = time() - start
+    
+    print '{:<10} {:8.3f}s {:10.2f} MB/s'.format(name, elapsed,
+                                                size / elapsed / 1024**2)
+
+
+def main():
+    streams = from_packages(sys.argv[1:]) if len(sys.argv) > 1 else synthetic()
+    streams = [str(stream) for stream in streams]
+    sizes = [uncompressed_size(stream) for stream in streams]
+    size = sum(sizes)
+    
+    python = lambda stream: qfs._decompress(buffer(stream, 9), uncompressed_size(stream))
+    for stream in streams:
+        assert python(stream) == legacy_decompress(stream)
+        if not native._libqfs() is None:
+            assert native.decompress(buffer(stream, 9), uncompressed_size(stream)) == python(stream)
+    
+    print '{} streams, {:.2f} MB uncompressed'.format(len(streams), size / 1024.0**2)
+    
+    measure('legacy', legacy_decompress, streams, size)
+    measure('python', python, streams, size)
+    if not native._libqfs() is None:
+        measure('native', lambda stream: native.decompress(buffer(stream, 9),
+                                                           uncompressed_size(stream)),
+                streams, size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''measures how long a fresh interpreter takes to import simtools and to
+list the index of a package, and which optional dependencies got loaded
+
+usage: python bench/startup.py [package.dat] [runs]
+
+every run is a new interpreter, the best and median times are reported.
+'''
+import sys
+import os.path
+import subprocess
+from itertools import izip
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT = '''
+import sys
+from time import time
+sys.path.insert(0, {root!r})
+start = time()
+import simtools
+print time() - start
+'''
+
+LIST = IMPORT + '''
+start = time()
+with simtools.DBPF.open({path!r}) as package:
+    count = sum(1 for index in package)
+print time() - start
+'''
+
+MODULES = IMPORT + '''
+from simtools.ext import squish, qfs
+print ' '.join(str(loaded) for loaded in
+               ['PIL' in sys.modules, 'numpy' in sys.modules,
+                'sqlite3' in sys.modules, 'multiprocessing' in sys.modules,
+                'tempfile' in sys.modules, not squish.libsquish is None,
+                not qfs.libqfs is None])
+'''
+
+
+def run(code):
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return output.split()
+
+
+def measure(name, code, runs, column=0):
+    times = sorted(float(run(code)[column]) for _ in xrange(runs))
+
+    print '{:<10} best {:8.2f}ms median {:8.2f}ms'.format(name, times[0]*1000,
+                                                       times[len(times)//2]*1000)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    names = ('PIL', 'numpy', 'sqlite3', 'multiprocessing', 'tempfile', 'libsquish',
+             'libqfs')
+    loaded = run(MODULES.format(root=ROOT))[1:]
+    print 'loaded by import simtools: ' + ', '.join('{} {}'.format(name, value)
+                                                    for name, value in izip(names, loaded))
+
+    measure('import', IMPORT.format(root=ROOT), runs)
+    if not path is None:
+        measure('list', LIST.format(root=ROOT, path=os.path.abspath(path)), runs, 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,93 @@
-from os import SEEK_SET
+from os import SEEK_SET, SEEK_END
+from mmap import mmap as memory_map, ACCESS_READ
 from random import randint
 from itertools import izip
+from time import time
+from array import array
+from stat import S_IMODE
+import os
 
 from simtools import dbpf
-from simtools.util import enforce
+from simtools.qfs import decompress, try_compress, LEVELS
+from simtools.magic import magic_type, decode
+from simtools.util import enforce, coalesce, advise
 
 group_id_factory = lambda: randint(0x10000000, 0xffffffff)
 
+
+def _decode_entry(args):
+    type_id, compressed, data = args
+    
+    if compressed:
+        header, data = decompress(data)
+    
+    return decode(type_id, data)
+
+def _extract_entry(args):
+    path, compressed, data = args
+    
+    if compressed:
+        header, data = decompress(data)
+    
+    with open(path, 'wb') as f:
+        f.write(data)
+    
+    return path
+
+
+def _pool(workers, executor):
+    # multiprocessing is only imported by packages which extract in parallel
+    from multiprocessing import Pool
+    from multiprocessing.pool import ThreadPool
+    
+    return Pool(workers) if executor == 'process' else ThreadPool(workers)
+
+def _merge_holes(holes):
+    merged = list()
+    for location, size in sorted(holes):
+        if merged and merged[-1][0] + merged[-1][1] >= location:
+            last = merged.pop()
+            size = max(sum(last), location + size) - last[0]
+            location = last[0]
+        merged.append((location, size))
+    
+    return merged
+
+def _allocate(holes, size, end):
+    '''returns the location for size bytes and the new end of the file,
+    the smallest hole which is large enough is used'''
+    fitting = [(hole[1], i) for i, hole in enumerate(holes) if hole[1] >= size]
+    if not size or not fitting:
+        return end, end + size
+    
+    _, i = min(fitting)
+    location, free = holes[i]
+    if free == size:
+        del holes[i]
+    else:
+        holes[i] = (location + size, free - size)
+    
+    return location, end
+
+
 class DBPF(object):
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, mmap=False, cache_size=None, disk_cache=None,
+                       index_cache=None):
         self._fileobj = fileobj
+        self._mmap = None
+        
+        if mmap:
+            self._mmap = memory_map(fileobj.fileno(), 0, access=ACCESS_READ)
+        
+        self.cache = None
+        if cache_size:
+            from simtools.cache import ResourceCache
+            self.cache = ResourceCache(cache_size)
+        self.disk_cache = disk_cache
+        self.index_cache = index_cache
     
         self.header = None
-        self.indices = list()
+        self.indices = None
         self.holes = list()
         
         self._parse_file()
@@ -20,13 +95,37 @@ class DBPF(object):
         self._iter = iter(self.indices)
     
     @classmethod
-    def open(cls, path):
-        return cls(open(path, 'rb'))
+    def open(cls, path, mmap=False, writable=False, cache_size=None,
+                        disk_cache=None, index_cache=None):
+        '''opens the package at path, with mmap=True entry payloads are
+        sliced out of a read-only memory mapping instead of being read,
+        writable=True is required for update and compact, cache_size
+        is the budget in bytes for decoded files kept in the cache,
+        disk_cache is a DiskCache for decompressed entries and decoded
+        textures which persists across runs, with an IndexCache the tables
+        of unchanged packages aren't parsed again'''
+        return cls(open(path, 'r+b' if writable else 'rb'), mmap, cache_size,
+                   disk_cache, index_cache)
     
     def close(self):
+        if not self._mmap is None:
+            self._mmap.close()
         self._fileobj.close()
+    
+    def _remap(self):
+        # the old mapping is left to the garbage collector, buffers
+        # returned by earlier reads may still point into it
+        self._mmap = memory_map(self._fileobj.fileno(), 0, access=ACCESS_READ)
+        
+        self.indices._mmap = self._mmap
+        for position, index in self.indices.cached():
+            index._mmap = self._mmap
 
     def _parse_file(self):
+        key = self._index_cache_key()
+        if not key is None and self._load_index_cache(key):
+            return
+        
         self.header = dbpf.Header.parse(self._fileobj)
 
         enforce(self.header.magic == 'DBPF', ValueError, 'This is not a valid DBPF file.')
@@ -35,119 +134,491 @@ class DBPF(object):
         self._extract_indices()
         self._extract_holes()
         self._mark_compressed()
+        
+        if not key is None:
+            self.index_cache.put(*(key + (self.header.raw(), self.indices.raw(),
+                                 ''.join(hole.raw() for hole in self.holes),
+                                 self.indices.compressed.tostring(),
+                                 self.indices.uncompressed_sizes.tostring())))
+    
+    def _index_cache_key(self):
+        name = getattr(self._fileobj, 'name', None)
+        if self.index_cache is None or not isinstance(name, basestring):
+            return None
+        
+        stat = os.fstat(self._fileobj.fileno())
+        return (os.path.abspath(name), stat.st_size, stat.st_mtime)
+    
+    def _load_index_cache(self, key):
+        tables = self.index_cache.get(*key)
+        if tables is None:
+            return False
+        
+        header, indices, holes, compressed, uncompressed_sizes = tables
+        
+        self.header = dbpf.Header(self._fileobj, *dbpf.Header._struct.unpack(header))
+        self.indices = dbpf.IndexTable(dbpf.index(self.header.index_version),
+                                       indices, self._fileobj, self._mmap,
+                                       self.cache, self.disk_cache)
+        self.indices.compressed = array('B', compressed)
+        self.indices.uncompressed_sizes = array(dbpf.UINT32, uncompressed_sizes)
+        if self.header.holes_count >= 1:
+            self.holes = dbpf.Hole.parse_many(holes, self.header.holes_count)
+        
+        return True
     
     def _extract_indices(self):
+        Index = dbpf.index(self.header.index_version)
+        data = ''
+        
         if self.header.index_count >= 1:
-            Index = dbpf.index(self.header.index_version)
+            size = self.header.index_count*Index._struct.size
             
             self._fileobj.seek(self.header.index_offset, SEEK_SET)
+            data = self._fileobj.read(size)
             
-            for _ in xrange(self.header.index_count):
-                self.indices.append(Index.parse(self._fileobj))
-            
-            if not self._fileobj.tell() == (self.header.index_offset + self.header.index_size):
+            if not (len(data) == size and size == self.header.index_size):
                 raise ValueError('incorrect amount of data read, file to small?')
+        
+        self.indices = dbpf.IndexTable(Index, data, self._fileobj, self._mmap,
+                                       self.cache, self.disk_cache)
     
     def _extract_holes(self):
         if self.header.holes_count >= 1:
             self._fileobj.seek(self.header.holes_offset, SEEK_SET)
             
-            for _ in xrange(self.header.holes_count):
-                self.holes.append(dbpf.Hole.parse(self._fileobj))
+            self.holes = dbpf.Hole.parse_many(self._fileobj, self.header.holes_count)
                 
             if not self._fileobj.tell() == (self.header.holes_offset + self.header.holes_size):
                 raise ValueError('incorrect amount of data read, file to small?')
             
     def _mark_compressed(self):
-        for index in self.indices:
-            if index.type_id == 0xe86b1eef:
-                DIR = dbpf.dir(self.header.index_version)
-                if self.header.index_version == '7.0':
-                    records = index.size / 16
-                else:
-                    records = index.size / 20
+        DIR = dbpf.dir(self.header.index_version)
+        
+        for position in self.indices.by_type(0xe86b1eef):
+            index = self.indices[position]
+            
+            self._fileobj.seek(index.location, SEEK_SET)
+            records = DIR.parse_records(self._fileobj.read(index.size))
+            
+            for key, size in records.iteritems():
+                found = self.indices.find(key)
+                if not found is None:
+                    self.indices.set_compressed(found, True, size)
+    
+    def get(self, type_id, group_id, instance_id, instance2_id=None, default=None):
+        '''returns the index of the entry with the given type, group and
+        instance (and instance2 for 7.1 packages), default if not found'''
+        key = (type_id, group_id, instance_id)
+        if not instance2_id is None:
+            key += (instance2_id,)
+        
+        position = self.indices.find(key)
+        if position is None:
+            return default
+        
+        return self.indices[position]
+    
+    def by_type(self, type_id):
+        '''iterates over all indices with the given type id'''
+        for position in self.indices.by_type(type_id):
+            yield self.indices[position]
 
-                self._fileobj.seek(index.location, SEEK_SET)
-                
-                indices = self.indices[:]
-                for _ in xrange(records):
-                    parsed = DIR.parse(self._fileobj)
-                    
-                    for index in indices:
-                        if parsed.equals_index(index):
-                            index.compressed = True
-                            indices.remove(index)           
+    def add(self, file, type_id, group_id, instance_id, instance2_id=None):
+        '''adds file as a new entry, it is written by the next save or
+        update'''
+        Index = self.indices.Index
+        
+        key = (type_id, group_id, instance_id)
+        if 'instance2_id' in Index._fields:
+            key += (instance2_id or 0,)
+        else:
+            enforce(instance2_id is None, ValueError,
+                    'instance2_id requires index version 7.1')
+        
+        index = Index(self._fileobj, *(key + (0, 0)))
+        index._mmap = self._mmap
+        index._cache = self.cache
+        index._disk_cache = self.disk_cache
+        index._file = file
+        index._dirty = True
+        self.indices.append(index)
+        
+        return index
 
+    def extract_all(self, dest=None, workers=None, executor='process',
+                    batch=256):
+        '''decompresses all entries using a pool of workers, with dest the
+        entry data is written to a file per entry in dest and the paths are
+        returned, otherwise (index, file) tuples of the decoded entries are
+        yielded in index order
+        
+        executor is either 'process' or 'thread', threads only run in
+        parallel with the native qfs decompressor'''
+        enforce(executor in ('process', 'thread'), ValueError,
+                'executor has to be either process or thread')
+        
+        from multiprocessing import cpu_count
+        workers = workers or cpu_count()
+        
+        if dest is None:
+            return self._extract_all(workers, executor, batch)
+        
+        pool = _pool(workers, executor)
+        try:
+            paths = list()
+            for indices in self._batches(batch):
+                tasks = [(os.path.join(dest, self._entry_filename(index)),
+                          index.compressed, data)
+                         for index, data in izip(indices,
+                                                 self._entry_data(indices, executor))]
+                paths.extend(pool.map(_extract_entry, tasks))
+        finally:
+            pool.terminate()
+        
+        return paths
+    
+    def _extract_all(self, workers, executor, batch):
+        # the pool is only started once the generator is iterated, the
+        # finally clause can't clean up a generator which never ran
+        pool = _pool(workers, executor)
+        try:
+            for indices in self._batches(batch):
+                tasks = [(index.type_id, index.compressed, data)
+                         for index, data in izip(indices,
+                                                 self._entry_data(indices, executor))]
+                
+                for item in izip(indices, pool.map(_decode_entry, tasks)):
+                    yield item
+        finally:
+            pool.terminate()
+    
+    def _batches(self, size):
+        # bounds the amount of entry data held in memory at once
+        indices = [index for index in self.indices
+                   if not index.type_id == 0xe86b1eef]
+        
+        for start in xrange(0, len(indices), size):
+            yield indices[start:start+size]
+    
+    def _entry_data(self, indices, executor):
+        # the batch is read in location order, but returned in index order
+        data = [None]*len(indices)
+        for position, entry in self._read_spans([(index.location, index.size)
+                                                 for index in indices]):
+            # buffers into the mapping can't be sent to another process
+            data[position] = str(entry) if executor == 'process' else entry
+        
+        return data
+    
+    def _read_spans(self, ranges, gap=1 << 16, limit=1 << 24):
+        # yields (position, data) of the (location, size) ranges, nearby
+        # ranges are merged into one read
+        spans = coalesce(ranges, gap, limit)
+        for offset, size, positions in spans:
+            advise(self._fileobj, offset, size)
+        
+        for offset, size, positions in spans:
+            if self._mmap is None:
+                self._fileobj.seek(offset, SEEK_SET)
+                data = self._fileobj.read(size)
+                enforce(len(data) == size, ValueError, 'unexpected end of file')
+            
+            for position in positions:
+                location, length = ranges[position]
+                if self._mmap is None:
+                    yield position, data[location - offset:location - offset + length]
+                else:
+                    yield position, buffer(self._mmap, location, length)
+    
+    def read_many(self, indices, gap=1 << 16, limit=1 << 24):
+        '''yields (index, data) with the raw data of indices ordered by
+        location, entries at most gap bytes apart are read at once, unless
+        the read would be larger than limit'''
+        indices = list(indices)
+        
+        for position, data in self._read_spans([(index.location, index.size)
+                                                for index in indices],
+                                               gap, limit):
+            yield indices[position], data
+    
+    def open_many(self, indices, gap=1 << 16, limit=1 << 24):
+        '''yields (index, file) of the decoded entries of indices, entries
+        which are already decoded come first, the others are read with
+        read_many'''
+        pending = list()
+        for index in indices:
+            if not index._file is None or (not self.cache is None and
+                                           (index.location, index.size) in self.cache):
+                yield index, index.open()
+            else:
+                pending.append(index)
+        
+        for index, data in self.read_many(pending, gap, limit):
+            yield index, index.open(data=data)
+    
+    def _entry_filename(self, index):
+        key = (index.type_id, index.group_id, index.instance_id)
+        if 'instance2_id' in index._fields:
+            key += (index.instance2_id,)
+        
+        return '{}.{}'.format('-'.join('{:08x}'.format(part) for part in key),
+                              magic_type(index.type_id).type.lower())
 
-    def save(self, path):
+    def save(self, path, level=None, budget=None):
+        '''writes the package to path, with a compression level (see
+        simtools.qfs.LEVELS) uncompressed entries are compressed, until
+        budget seconds have passed
+        
+        entries are written one after another, entries which weren't added
+        or replaced are copied straight from this package'''
+        enforce(not (os.path.exists(path) and
+                     os.path.samefile(path, self._fileobj.name)),
+                ValueError, 'can not save a package over itself')
+        enforce(level is None or level in LEVELS, ValueError,
+                'unknown compression level')
+        
+        deadline = None if budget is None else time() + budget
         version = self.header.index_version
         DIR = dbpf.dir(version)
         Index = dbpf.index(version)
         
-        files = list()
         dirs = list()
-        indices = list()
-        compressed_files = 0
-        for index in self.indices:
-            if index.type_id == 0xe86b1eef:
-                continue
-            
-            compressed, data = index.dump_file()
+        indices_data = list()
+        
+        with open(path, 'wb') as f:
+            # the header is written last, when the index offset is known
+            offset = dbpf.Header._struct.size
+            f.write('\0' * offset)
             
-            if compressed:
-                compressed_files += 1
+            for index in self.indices:
+                if index.type_id == 0xe86b1eef:
+                    continue
+                
+                compress = not level is None and \
+                           (deadline is None or time() < deadline)
+                
+                # entries which were only opened are copied as well
+                if not index._dirty and (index.compressed or not compress):
+                    compressed = index.compressed
+                    size = index.uncompressed_size
+                    length = index.size
+                    index.copy_to(f)
+                else:
+                    compressed, data = index.dump_file()
+                    size = len(data)
+                    if compress:
+                        compressed, data = try_compress(data, level)
+                    length = len(data)
+                    f.write(data)
+                
                 args = index._data.copy()
-                del args['location']
-                if not index._file is None:
-                    args['size'] = len(index._file.raw())
-
-                dirs.append(DIR(*args.values()).raw())
+                args['location'] = offset
+                args['size'] = length
+                indices_data.append(Index(*args.values()).raw())
                 
-            indices.append(index)
-            files.append(data)
-
-        indices_data = list() 
-       
-        offset = dbpf.Header._struct.size
-        offset += len(indices)*Index._struct.size
-        offset += Index._struct.size if compressed_files > 0 else 0
-        
-        for index, file in izip(indices, files):
-            index.location = offset
-            index.size = len(file)
-            indices_data.append(index.raw())
+                if compressed:
+                    del args['location']
+                    args['size'] = size
+                    dirs.append(DIR(*args.values()).raw())
+                
+                offset += length
             
-            offset += index.size
-        
-        if compressed_files > 0:
-            if version == '7.0':
-                args = (0xe86b1eef, 0xe86b1eef, 0x286b1f03,
-                        offset, compressed_files*DIR._struct.size)
-            else:
-                args = (0xe86b1eef, 0xe86b1eef, 0x286b1f03, 0x286b1f03,
-                        offset, compressed_files*DIR._struct.size)
+            if dirs:
+                if version == '7.0':
+                    args = (0xe86b1eef, 0xe86b1eef, 0x286b1f03,
+                            offset, len(dirs)*DIR._struct.size)
+                else:
+                    args = (0xe86b1eef, 0xe86b1eef, 0x286b1f03, 0x286b1f03,
+                            offset, len(dirs)*DIR._struct.size)
+                
+                indices_data.append(Index(*args).raw())
                 
-            indices_data.append(Index(*args).raw())
+                f.write(''.join(dirs))
+                offset += len(dirs)*DIR._struct.size
             
-        self.header.index_count = len(indices_data)
-        self.header.index_offset = 96
-        self.header.index_size = len(indices_data)*Index._struct.size
-        self.header.holes_count = 0
-        self.header.holes_offset = 0
-        self.header.holes_size = 0
-
-        indices_data = ''.join(indices_data)
-        
-        with open(path, 'w') as f:
-            f.write(self.header.raw())
-            f.write(indices_data)
+            f.write(''.join(indices_data))
             
-            for file in files:
-                f.write(file)
+            header = dbpf.Header(*self.header._data.values())
+            header.index_count = len(indices_data)
+            header.index_offset = offset
+            header.index_size = len(indices_data)*Index._struct.size
+            header.holes_count = 0
+            header.holes_offset = 0
+            header.holes_size = 0
             
-            f.write(''.join(dirs))
+            f.seek(0, SEEK_SET)
+            f.write(header.raw())
+        
+    
+    def update(self, level=None):
+        '''writes added and replaced entries into the package in place,
+        the entries are written into holes or appended to the file, only
+        the index, DIR and holes tables and the header are rewritten
+        
+        the space of replaced entries and of the old tables becomes new
+        holes, use compact to reclaim it'''
+        enforce('+' in self._fileobj.mode, ValueError,
+                'package has to be opened writable')
+        enforce(level is None or level in LEVELS, ValueError,
+                'unknown compression level')
+        
+        version = self.header.index_version
+        DIR = dbpf.dir(version)
+        Index = dbpf.index(version)
+        
+        f = self._fileobj
+        f.seek(0, SEEK_END)
+        end = f.tell()
+        
+        # entries which were only opened are left where they are
+        dirty = [(position, index) for position, index in self.indices.cached()
+                 if index._dirty and not index.type_id == 0xe86b1eef]
+        directory = next(self.by_type(0xe86b1eef), None)
+        
+        # only space which was free before the update is reused, so the
+        # old data is still intact if the update is interrupted
+        holes = _merge_holes((hole.location, hole.size) for hole in self.holes)
+        freed = [(index.location, index.size) for _, index in dirty if index.size]
+        if not directory is None and directory.size:
+            freed.append((directory.location, directory.size))
+        if self.header.index_size:
+            freed.append((self.header.index_offset, self.header.index_size))
+        if self.header.holes_size:
+            freed.append((self.header.holes_offset, self.header.holes_size))
+        
+        # DIR data, index and holes table are written as one block which is
+        # allocated first, so it can take the space of the previous block.
+        # Capacities are upper bounds rounded up, which keeps the block size
+        # stable between updates, merging never increases the number of
+        # holes, the unused rest of the block is recorded as a hole.
+        dirs_size = sum(self.indices.compressed) + len(dirty)
+        dirs_size = ((dirs_size + 63) & ~63)*DIR._struct.size
+        index_size = (len(self.indices) + (directory is None))*Index._struct.size
+        holes_size = ((len(holes) + len(freed) + 1 + 63) & ~63)*dbpf.Hole._struct.size
+        block_size = dirs_size + index_size + holes_size
+        location, end = _allocate(holes, block_size, end)
+        
+        for position, index in dirty:
+            compressed, data = index.dump_file()
+            size = len(data)
+            if not level is None:
+                compressed, data = try_compress(data, level)
+            
+            index.location, end = _allocate(holes, len(data), end)
+            f.seek(index.location, SEEK_SET)
+            f.write(data)
+            
+            index.size = len(data)
+            index._file = None
+            index._dirty = False
+            self.indices.sync(position)
+            self.indices.set_compressed(position, compressed, size)
+        
+        dirs = list()
+        for position in xrange(len(self.indices)):
+            if self.indices.compressed[position]:
+                row = self.indices.row(position)
+                dirs.append(DIR._struct.pack(*(row[:-2] + (self.indices.uncompressed_sizes[position],))))
+        dirs = ''.join(dirs)
+        
+        if directory is None and dirs:
+            if version == '7.0':
+                args = (0xe86b1eef, 0xe86b1eef, 0x286b1f03, 0, 0)
+            else:
+                args = (0xe86b1eef, 0xe86b1eef, 0x286b1f03, 0x286b1f03, 0, 0)
+            
+            directory = Index(self._fileobj, *args)
+            directory._mmap = self._mmap
+            directory._cache = self.cache
+            directory._disk_cache = self.disk_cache
+            self.indices.append(directory)
+        
+        if not directory is None:
+            directory.location = location
+            directory.size = len(dirs)
+            self.indices.sync(self.indices.by_type(0xe86b1eef)[0])
+        
+        index_data = ''.join(Index._struct.pack(*self.indices.row(position))
+                             for position in xrange(len(self.indices)))
+        used = len(dirs) + len(index_data)
+        
+        holes = _merge_holes(holes + freed)
+        
+        # the rest of the block starts after the holes table, which may
+        # shrink if the rest is merged with a following hole
+        count = len(holes) + 1
+        while True:
+            rest = location + used + count*dbpf.Hole._struct.size
+            table = _merge_holes(holes + [(rest, location + block_size - rest)])
+            table = [hole for hole in table if hole[1]]
+            if len(table) == count:
+                break
+            count = len(table)
+        holes = table
+        
+        f.seek(location, SEEK_SET)
+        f.write(dirs)
+        f.write(index_data)
+        f.write(''.join(dbpf.Hole._struct.pack(*hole) for hole in holes))
+        f.flush()
+        
+        self.header.index_count = len(self.indices)
+        self.header.index_offset = location + len(dirs)
+        self.header.index_size = len(index_data)
+        self.header.holes_count = len(holes)
+        self.header.holes_offset = location + used if holes else 0
+        self.header.holes_size = len(holes)*dbpf.Hole._struct.size
+        
+        f.seek(0, SEEK_SET)
+        f.write(self.header.raw())
+        
+        # holes must not reach past the end of the file
+        f.seek(0, SEEK_END)
+        if f.tell() < end:
+            f.truncate(end)
+        f.flush()
+        
+        self.holes = [dbpf.Hole(*hole) for hole in holes]
+        
+        # entries may now be at locations of replaced entries
+        if not self.cache is None:
+            self.cache.clear()
+        # the modification time might not have changed on coarse clocks
+        if not self.index_cache is None:
+            self.index_cache.discard(os.path.abspath(self._fileobj.name))
+        
+        if not self._mmap is None:
+            self._remap()
+    
+    def compact(self, level=None):
+        '''rewrites the package without holes, Index objects of this package
+        are invalid afterwards'''
+        enforce('+' in self._fileobj.mode, ValueError,
+                'package has to be opened writable')
+        
+        from tempfile import mkstemp
+        
+        path = self._fileobj.name
+        handle, temp = mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        os.close(handle)
+        
+        try:
+            self.save(temp, level)
+            # mkstemp creates the file only readable by its owner
+            os.chmod(temp, S_IMODE(os.stat(path).st_mode))
+        except:
+            os.remove(temp)
+            raise
+        
+        mmap = not self._mmap is None
+        cache_size = None if self.cache is None else self.cache.budget
+        self.close()
+        os.rename(temp, path)
+        
+        self.__init__(open(path, 'r+b'), mmap, cache_size, self.disk_cache,
+                      self.index_cache)
         
-                            
     def __enter__(self):
         return self
     
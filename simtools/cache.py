@@ -0,0 +1,286 @@
+from collections import OrderedDict, namedtuple
+from itertools import islice
+from threading import Lock
+from hashlib import sha1
+from stat import S_IMODE
+import os
+
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions',
+                                       'count', 'size', 'budget'])
+
+
+class ResourceCache(object):
+    '''least recently used cache of decoded files, bounded by the sum of
+    their memory_size() in bytes, files grow when parts are decoded lazily,
+    so a file is measured again when it's used, and before evicting the
+    last remeasure files which were put or used are measured again, they
+    are the ones which are still being decoded'''
+    def __init__(self, budget, remeasure=8):
+        self.budget = budget
+        self.remeasure = remeasure
+        self.size = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._files = OrderedDict()
+        self._lock = Lock()
+    
+    def get(self, key):
+        with self._lock:
+            try:
+                item = self._files.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            
+            # reinserting moves the file to the most recently used end
+            file, size = item
+            self._files[key] = (file, file.memory_size())
+            self.size += self._files[key][1] - size
+            self.hits += 1
+            
+            self._evict()
+            
+            return file
+    
+    def put(self, key, file):
+        size = file.memory_size()
+        
+        with self._lock:
+            if key in self._files:
+                self.size -= self._files.pop(key)[1]
+            
+            if size > self.budget:
+                return
+            
+            self._files[key] = (file, size)
+            self.size += size
+            
+            self._evict()
+    
+    def _measure(self):
+        # bounded, measuring every file on every put would make filling the
+        # cache quadratic
+        for key in list(islice(reversed(self._files), self.remeasure)):
+            file, size = self._files[key]
+            measured = file.memory_size()
+            if not measured == size:
+                self._files[key] = (file, measured)
+                self.size += measured - size
+    
+    def _evict(self):
+        self._measure()
+        
+        # the most recently used file is kept, even if it outgrew the budget
+        # on its own
+        while self.size > self.budget and len(self._files) > 1:
+            _, (_, evicted) = self._files.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+    
+    def discard(self, key):
+        with self._lock:
+            if key in self._files:
+                self.size -= self._files.pop(key)[1]
+    
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+            self.size = 0
+    
+    def stats(self):
+        with self._lock:
+            self._evict()
+            return CacheStats(self.hits, self.misses, self.evictions,
+                              len(self._files), self.size, self.budget)
+    
+    def __len__(self):
+        return len(self._files)
+    
+    def __contains__(self, key):
+        return key in self._files
+
+
+class DiskCache(object):
+    '''least recently used cache of decoded data in a directory, the files
+    are named by their key and hold the data as it is, so they can be read
+    or memory mapped directly, the directory can be shared by packages and
+    is kept across runs, bounded by the sum of the file sizes in bytes'''
+    def __init__(self, path, budget):
+        self.path = path
+        self.budget = budget
+        self.size = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._files = OrderedDict()
+        self._lock = Lock()
+        
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # mkstemp creates files only readable by their owner, they get the
+        # permissions of the directory instead, without execute
+        self._mode = S_IMODE(os.stat(path).st_mode) & 0666
+        
+        # the modification time is updated on every hit, so the oldest
+        # file is the least recently used one
+        files = list()
+        for name in os.listdir(path):
+            if name.startswith('.'):
+                # temporary file of an interrupted put
+                continue
+            stat = os.stat(os.path.join(path, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+        
+        for _, name, size in sorted(files):
+            self._files[name] = size
+            self.size += size
+    
+    @staticmethod
+    def key(data, kind):
+        '''returns the key of data decoded as kind, content addressed by a
+        hash of the encoded data'''
+        return '%s.%s' % (sha1(data).hexdigest(), kind)
+    
+    def get(self, key):
+        with self._lock:
+            try:
+                size = self._files.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            
+            path = os.path.join(self.path, key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path, None)
+            except (IOError, OSError):
+                # removed by another process sharing the directory
+                self.size -= size
+                self.misses += 1
+                return None
+            
+            self._files[key] = size
+            self.hits += 1
+            
+            return data
+    
+    def put(self, key, data):
+        data = buffer(data)
+        size = len(data)
+        
+        with self._lock:
+            if key in self._files or size > self.budget:
+                return
+            
+            # written to a temporary file first, readers never see
+            # incomplete files
+            from tempfile import mkstemp
+            fd, temp = mkstemp(dir=self.path, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(temp, self._mode)
+            os.rename(temp, os.path.join(self.path, key))
+            
+            self._files[key] = size
+            self.size += size
+            
+            while self.size > self.budget:
+                evicted, evicted_size = self._files.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+                
+                try:
+                    os.remove(os.path.join(self.path, evicted))
+                except OSError:
+                    pass
+    
+    def clear(self):
+        with self._lock:
+            for name in self._files:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+            
+            self._files.clear()
+            self.size = 0
+    
+    def stats(self):
+        return CacheStats(self.hits, self.misses, self.evictions,
+                          len(self._files), self.size, self.budget)
+    
+    def __len__(self):
+        return len(self._files)
+    
+    def __contains__(self, key):
+        return key in self._files
+
+
+class IndexCache(object):
+    '''sqlite database of the parsed tables of packages, an entry is only
+    used while the size and modification time of the package match, it
+    can be shared by any number of packages'''
+    def __init__(self, path):
+        import sqlite3
+        
+        self.path = path
+        
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # losing the last writes of a cache on a crash is harmless
+        self._db.execute('PRAGMA synchronous = OFF')
+        self._db.execute('CREATE TABLE IF NOT EXISTS packages ('
+                         'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                         'header BLOB, indices BLOB, holes BLOB, '
+                         'compressed BLOB, uncompressed_sizes BLOB)')
+        self._db.commit()
+    
+    def get(self, path, size, mtime):
+        '''returns the raw (header, indices, holes, compressed,
+        uncompressed_sizes) tables of the package or None'''
+        with self._lock:
+            row = self._db.execute('SELECT header, indices, holes, compressed, '
+                                   'uncompressed_sizes FROM packages WHERE '
+                                   'path = ? AND size = ? AND mtime = ?',
+                                   (path, size, mtime)).fetchone()
+        
+        if row is None:
+            return None
+        return tuple(str(column) for column in row)
+    
+    def put(self, path, size, mtime, header, indices, holes, compressed,
+                  uncompressed_sizes):
+        # sqlite3.Binary is buffer, stored as BLOB
+        tables = [buffer(table) for table in
+                  (header, indices, holes, compressed, uncompressed_sizes)]
+        
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO packages VALUES '
+                             '(?, ?, ?, ?, ?, ?, ?, ?)',
+                             [path, size, mtime] + tables)
+            self._db.commit()
+    
+    def discard(self, path):
+        with self._lock:
+            self._db.execute('DELETE FROM packages WHERE path = ?', (path,))
+            self._db.commit()
+    
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM packages')
+            self._db.commit()
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+    
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM packages').fetchone()[0]
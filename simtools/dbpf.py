@@ -1,9 +1,11 @@
 from struct import Struct
 from os import SEEK_SET
+from array import array
+from sys import byteorder
 
-from simtools.qfs import decompress, try_compress
-from simtools.util import BaseStruct
-from simtools.magic import magic_index
+from simtools.qfs import decompress
+from simtools.util import BaseStruct, copy_range
+from simtools.magic import decode
 
 
 class Header(BaseStruct):
@@ -47,30 +49,97 @@ class Header(BaseStruct):
     
 
 class IndexBaseStruct(BaseStruct):
+    __slots__ = ('compressed', 'uncompressed_size', '_file', '_dirty', '_mmap',
+                 '_cache', '_disk_cache')
+    
     def __init__(self, *args, **kwargs):
         BaseStruct.__init__(self, *args, **kwargs)
         
         self.compressed = False
+        self.uncompressed_size = None
         self._file = None
+        self._dirty = False
+        self._mmap = None
+        self._cache = None
+        self._disk_cache = None
+    
+    def _read(self, fileobj=None):
+        '''returns the raw entry data, a zero-copy buffer into the mapping
+        if the package was opened with mmap, fileobj is another handle of
+        the package to read from'''
+        if self._mmap is None:
+            fileobj = fileobj or self._fileobj
+            fileobj.seek(self.location, SEEK_SET)
+            return fileobj.read(self.size)
+        
+        return buffer(self._mmap, self.location, self.size)
+        
+    def copy_to(self, fileobj):
+        '''copies the raw entry data to the current position of fileobj'''
+        if self._mmap is None:
+            copy_range(self._fileobj, fileobj, self.location, self.size)
+        else:
+            fileobj.write(buffer(self._mmap, self.location, self.size))
+        
+    def open(self, fileobj=None, data=None):
+        '''decodes the entry, if the package has a cache the file is shared
+        through the cache, changes have to be stored with replace,
+        otherwise the file is kept on the index until the package is saved,
+        fileobj is another handle of the package to read from, threads
+        can't share a handle, data is the raw entry data if it was already
+        read'''
+        if not self._file is None:
+            return self._file
+        
+        if not self._cache is None:
+            file = self._cache.get((self.location, self.size))
+            if not file is None:
+                return file
         
-    def open(self):
-        self._fileobj.seek(self.location, SEEK_SET)
-        data = self._fileobj.read(self.size)
+        if data is None:
+            data = self._read(fileobj)
         
         if self.compressed:
-            header, data = decompress(data)
+            data = self._decompress(data)
         
-        type = magic_index(self)
-        self._file = type.cls(data)
+        file = decode(self.type_id, data)
+        if not self._disk_cache is None:
+            file.set_disk_cache(self._disk_cache)
+        
+        if self._cache is None:
+            self._file = file
+        else:
+            self._cache.put((self.location, self.size), file)
 
-        return self._file
+        return file
+    
+    def _decompress(self, data):
+        # the disk cache is keyed by the compressed data, so it also hits
+        # for the same entry in other packages
+        if self._disk_cache is None:
+            return decompress(data)[1]
+        
+        key = self._disk_cache.key(data, 'qfs')
+        result = self._disk_cache.get(key)
+        if result is None:
+            result = decompress(data)[1]
+            self._disk_cache.put(key, result)
+        
+        return result
+    
+    def replace(self, file):
+        '''replaces the content of the entry with file, it is written by
+        the next save or update'''
+        self._file = file
+        self._dirty = True
+        
+        if not self._cache is None:
+            self._cache.discard((self.location, self.size))
 
     def dump_file(self):
-        if self._file is None:
-            self._fileobj.seek(self.location, SEEK_SET)
-            return self.compressed, self._fileobj.read(self.size)
+        if not self._dirty:
+            return self.compressed, self._read()
 
-        #return try_compress(self._file.raw()) # TODO: fix compression, so reader can read it
         return False, self._file.raw()
     
     def __repr__(self):
@@ -99,6 +168,143 @@ class Index71(IndexBaseStruct):
                'location',
                'size']
 
+# typecode of an unsigned 32bit integer for array
+UINT32 = 'I' if array('I').itemsize == 4 else 'L'
+
+class IndexTable(object):
+    '''columnar table of all index entries of a package, the Index objects
+    are only created from the table when they're accessed'''
+    def __init__(self, Index, data='', fileobj=None, mmap=None, cache=None,
+                       disk_cache=None):
+        self.Index = Index
+        self._fileobj = fileobj
+        self._mmap = mmap
+        self._cache = cache
+        self._disk_cache = disk_cache
+        
+        values = array(UINT32, data)
+        if byteorder == 'big':
+            values.byteswap()
+        
+        step = len(Index._fields)
+        self.columns = dict((field, values[i::step])
+                            for i, field in enumerate(Index._fields))
+        self.compressed = array('B', [0]) * len(self)
+        self.uncompressed_sizes = array(UINT32, [0]) * len(self)
+        
+        self._indices = dict()
+        self._lookup = None
+        self._types = None
+        
+    def __len__(self):
+        return len(self.columns['location'])
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in xrange(*item.indices(len(self)))]
+        
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('index out of range')
+        
+        try:
+            return self._indices[item]
+        except KeyError:
+            index = self.Index(self._fileobj, *self.row(item))
+            index.compressed = bool(self.compressed[item])
+            if index.compressed:
+                index.uncompressed_size = self.uncompressed_sizes[item]
+            index._mmap = self._mmap
+            index._cache = self._cache
+            index._disk_cache = self._disk_cache
+            
+            self._indices[item] = index
+            return index
+    
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+    
+    def raw(self):
+        '''returns the table as it is stored in a package'''
+        step = len(self.Index._fields)
+        
+        values = array(UINT32, [0]) * (len(self)*step)
+        for i, field in enumerate(self.Index._fields):
+            values[i::step] = self.columns[field]
+        if byteorder == 'big':
+            values.byteswap()
+        
+        return values.tostring()
+    
+    def row(self, item):
+        '''returns the raw field values of an entry without creating
+        an Index object'''
+        return tuple(self.columns[field][item] for field in self.Index._fields)
+    
+    def _build_lookup(self):
+        self._lookup = dict()
+        self._types = dict()
+        
+        for item in xrange(len(self)):
+            self._add_lookup(item)
+    
+    def _add_lookup(self, item):
+        row = self.row(item)
+        # first entry wins, 7.1 entries can also be found by type, group and
+        # instance alone
+        self._lookup.setdefault(row[:-2], item)
+        self._lookup.setdefault(row[:3], item)
+        self._types.setdefault(row[0], list()).append(item)
+    
+    def find(self, key):
+        '''returns the position of the entry with the given
+        (type, group, instance[, instance2]) tuple or None'''
+        if self._lookup is None:
+            self._build_lookup()
+        
+        return self._lookup.get(tuple(key))
+    
+    def by_type(self, type_id):
+        '''returns the positions of all entries with type_id'''
+        if self._types is None:
+            self._build_lookup()
+        
+        return self._types.get(type_id, [])
+    
+    def cached(self):
+        '''returns (position, index) tuples of all Index objects created so
+        far, ordered by position'''
+        return sorted(self._indices.items())
+    
+    def sync(self, item):
+        '''writes the fields of the Index object at item back into the
+        columns'''
+        index = self._indices[item]
+        for field in self.Index._fields:
+            self.columns[field][item] = getattr(index, field)
+    
+    def set_compressed(self, item, compressed=True, uncompressed_size=0):
+        self.compressed[item] = compressed
+        self.uncompressed_sizes[item] = uncompressed_size
+        
+        if item in self._indices:
+            self._indices[item].compressed = compressed
+            self._indices[item].uncompressed_size = uncompressed_size \
+                                                    if compressed else None
+    
+    def append(self, index):
+        for field in self.Index._fields:
+            self.columns[field].append(getattr(index, field))
+        self.compressed.append(index.compressed)
+        self.uncompressed_sizes.append(index.uncompressed_size or 0)
+        
+        self._indices[len(self) - 1] = index
+        if not self._lookup is None:
+            self._add_lookup(len(self) - 1)
+
+    
 def index(version):
     if isinstance(version, Header):
         version = version.index_version
@@ -116,6 +322,24 @@ class Hole(BaseStruct):
                'size']
 
 class DIRBaseStruct(BaseStruct):
+    @classmethod
+    def parse_records(cls, data):
+        '''parses the data of a DIR entry and returns a dict mapping the
+        (type, group, instance[, instance2]) key of every record to the
+        uncompressed size of the entry'''
+        values = array(UINT32, data[:len(data) - len(data) % cls._struct.size])
+        if byteorder == 'big':
+            values.byteswap()
+        
+        step = len(cls._fields)
+        keys = zip(*[values[i::step] for i in xrange(step - 1)])
+        
+        return dict(zip(keys, values[step - 1::step]))
+    
+    @property
+    def key(self):
+        return tuple(getattr(self, field) for field in self._fields[:-1])
+    
     def equals_index(self, index):
         return all(getattr(self, field) == getattr(index, field)
                    for field in self._fields[:-1])
@@ -0,0 +1,39 @@
+from ctypes import CDLL, c_int, c_char_p, create_string_buffer, string_at
+import os.path
+
+from simtools.util import enforce
+
+# optional native decompressor, simtools.qfs falls back to pure python
+# if the library wasn't built
+libqfs_path = os.path.join(os.path.split(os.path.abspath(__file__))[0], 'libqfsc.so')
+# loaded by the first call, False once loading failed
+libqfs = None
+
+
+def _libqfs():
+    '''returns the library or None if it wasn't built'''
+    global libqfs
+    
+    if libqfs is None:
+        try:
+            library = CDLL(libqfs_path)
+        except OSError:
+            libqfs = False
+        else:
+            library.Decompress.argtypes = [c_char_p, c_int, c_char_p, c_int]
+            library.Decompress.restype = c_int
+            libqfs = library
+    
+    return None if libqfs is False else libqfs
+
+
+def decompress(data, size):
+    data = str(data)
+    
+    result = create_string_buffer(size)
+    written = _libqfs().Decompress(data, len(data), result, size)
+    
+    enforce(written >= 0, ValueError, 'corrupt compressed data')
+    enforce(written == size, ValueError, 'truncated compressed data')
+    
+    return string_at(result, written)
@@ -0,0 +1,71 @@
+	/* gcc -O2 -shared -fPIC -o libqfsc.so qfs_ex.c */
+	#include <string.h>
+
+	typedef unsigned char u8;
+
+	static void copy( u8* dst, u8 const* src, int count ) {
+		/* source and destination may overlap, the result has to repeat
+		   the already written bytes, so memmove can't be used */
+		if( dst - src >= count ) {
+			memcpy(dst, src, count);
+		} else {
+			while( count-- ) {
+				*dst++ = *src++;
+			}
+		}
+	}
+
+	int Decompress( u8 const* data, int length, u8* result, int size ) {
+		int pos = 0;
+		int written = 0;
+
+		while( pos < length && written < size ) {
+			int opcode = data[pos];
+			int numplain, numcopy, offset;
+
+			if( opcode < 0x80 ) {
+				if( pos + 2 > length ) return -1;
+				numplain = opcode & 0x03;
+				numcopy = ((opcode & 0x1c) >> 2) + 3;
+				offset = ((opcode & 0x60) << 3) + data[pos+1] + 1;
+				pos += 2;
+			} else if( opcode < 0xc0 ) {
+				if( pos + 3 > length ) return -1;
+				numplain = (data[pos+1] & 0xc0) >> 6;
+				numcopy = (opcode & 0x3f) + 4;
+				offset = ((data[pos+1] & 0x3f) << 8) + data[pos+2] + 1;
+				pos += 3;
+			} else if( opcode < 0xe0 ) {
+				if( pos + 4 > length ) return -1;
+				numplain = opcode & 0x03;
+				numcopy = ((opcode & 0x0c) << 6) + data[pos+3] + 5;
+				offset = ((opcode & 0x10) << 12) + (data[pos+1] << 8) + data[pos+2] + 1;
+				pos += 4;
+			} else if( opcode < 0xfc ) {
+				numplain = ((opcode & 0x1f) << 2) + 4;
+				numcopy = 0;
+				offset = 0;
+				pos += 1;
+			} else {
+				numplain = opcode & 0x03;
+				numcopy = 0;
+				offset = 0;
+				pos += 1;
+			}
+
+			if( numplain ) {
+				if( pos + numplain > length || written + numplain > size ) return -1;
+				memcpy(result + written, data + pos, numplain);
+				pos += numplain;
+				written += numplain;
+			}
+
+			if( numcopy ) {
+				if( offset > written || written + numcopy > size ) return -1;
+				copy(result + written, result + written - offset, numcopy);
+				written += numcopy;
+			}
+		}
+
+		return written;
+	}
@@ -1,8 +1,12 @@
-from ctypes import CDLL, c_int, byref, create_string_buffer
+from ctypes import CDLL, Array, c_char, c_int, byref, create_string_buffer
+from operator import mul
 import os.path
 
+from simtools.util import enforce
+
 libsquish_path = os.path.join(os.path.split(os.path.abspath(__file__))[0], 'libsquishc.so')
-libsquish = CDLL(libsquish_path)
+# loaded by the first call, importing the module doesn't need the library
+libsquish = None
 
 
 DXT1 = 1 << 0 
@@ -15,26 +19,93 @@ COLOR_RANGE_FIT = 1 << 4
 WEIGHT_COLOR_BY_ALPHA = 1 << 7
 
 
-GetStorageRequirements = libsquish.GetStorageRequirements
-GetStorageRequirements.argtypes = [c_int, c_int, c_int]
-GetStorageRequirements.restype = c_int
+def _libsquish():
+    global libsquish
+    
+    if libsquish is None:
+        library = CDLL(libsquish_path)
+        library.GetStorageRequirements.argtypes = [c_int, c_int, c_int]
+        library.GetStorageRequirements.restype = c_int
+        libsquish = library
+    
+    return libsquish
+
+def GetStorageRequirements(width, height, flags):
+    return _libsquish().GetStorageRequirements(width, height, flags)
+
+def _size(data):
+    try:
+        return len(buffer(data))
+    except TypeError:
+        view = memoryview(data)
+        return view.itemsize*reduce(mul, view.shape, 1)
 
-def compress_image(rgba, width, height, flags):
-    rgba = create_string_buffer(rgba)
+def _pointer(data, writable=False):
+    '''returns a ctypes argument pointing at the memory of data, which is
+    anything supporting the buffer protocol, read-only buffers are only
+    copied if ctypes can't reference them'''
+    if isinstance(data, str) and not writable:
+        # ctypes passes strings as char* without copying them
+        return data
+    if isinstance(data, Array):
+        return byref(data)
+    
+    try:
+        return byref(c_char.from_buffer(data))
+    except (TypeError, ValueError):
+        enforce(not writable, TypeError, 'output buffer has to be writable')
+    
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return str(buffer(data))
+
+def compress_image(rgba, width, height, flags, out=None):
+    '''compresses rgba into a new string or into the writable buffer out,
+    which is returned, flags is a DXT format optionally combined with
+    one of the COLOR_* fit flags'''
+    enforce(_size(rgba) >= width*height*4, ValueError, 'rgba data too small')
     
     c = GetStorageRequirements(width, height, flags)
-    buf = create_string_buffer(c)
+    if out is None:
+        buf = create_string_buffer(c)
+    else:
+        enforce(_size(out) >= c, ValueError, 'output buffer too small')
+        buf = out
     
-    libsquish.CompressImage(byref(rgba), c_int(width), c_int(height), byref(buf), c_int(flags))
+    _libsquish().CompressImage(_pointer(rgba), c_int(width), c_int(height),
+                            _pointer(buf, True), c_int(flags))
     
-    return buf.raw
+    return buf.raw if out is None else out
 
-def decompress_image(block, width, height, flags):
-    block = create_string_buffer(block)
+def decompress_image(block, width, height, flags, out=None):
+    '''decompresses block into a new string or into the writable buffer
+    out, which is returned'''
+    enforce(_size(block) >= GetStorageRequirements(width, height, flags),
+            ValueError, 'compressed data too small')
     
     c = width*height*4
-    rgba = create_string_buffer(c)
+    if out is None:
+        rgba = create_string_buffer(c)
+    else:
+        enforce(_size(out) >= c, ValueError, 'output buffer too small')
+        rgba = out
+    
+    _libsquish().DecompressImage(_pointer(rgba, True), c_int(width), c_int(height),
+                              _pointer(block), c_int(flags))
+    
+    return rgba.raw if out is None else out
+
+def decompress_images(images, workers=None):
+    '''decompresses a list of (block, width, height, flags) tuples with a
+    pool of threads and returns the rgba data in the same order, ctypes
+    releases the GIL while libsquish runs, so the images are decompressed
+    in parallel'''
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
     
-    libsquish.DecompressImage(byref(rgba), c_int(width), c_int(height), byref(block), c_int(flags))
+    pool = ThreadPool(workers or cpu_count())
     
-    return rgba.raw
\ No newline at end of file
+    try:
+        return pool.map(lambda image: decompress_image(*image), images)
+    finally:
+        pool.terminate()
@@ -1,11 +1,21 @@
 from io import BytesIO
-from os import SEEK_SET
-from PIL import Image
+from struct import unpack_from
+from itertools import izip
+from array import array
+from sys import byteorder
+from os import SEEK_SET, SEEK_CUR
 
 from simtools import s3d
 from simtools import fsh
 from simtools.ext import squish
-from simtools.util import enforce
+from simtools.util import enforce, _numpy
+
+
+def _pil():
+    # PIL is only imported once an image is created, reading packages
+    # works without it
+    from PIL import Image
+    return Image
 
 
 class File(object):
@@ -16,6 +26,15 @@ class File(object):
     
     def raw(self):
         return self.data
+    
+    def memory_size(self):
+        '''estimated memory used by the decoded file in bytes'''
+        return len(self.data)
+    
+    def set_disk_cache(self, cache):
+        '''files with an expensive decoding step keep their decoded data
+        in cache, a DiskCache'''
+        pass
 
 
 class DIRFile(File):
@@ -26,175 +45,647 @@ class XMLFile(File):
     _type = 'XML' 
 
 
+def _chunk_property(chunk, attribute):
+    # parses the chunk on first access
+    def getter(self):
+        if not chunk in self._parsed:
+            self._parse_chunk(chunk)
+        return getattr(self, '_' + attribute)
+    
+    def setter(self, value):
+        if not chunk in self._parsed:
+            self._parse_chunk(chunk)
+        setattr(self, '_' + attribute, value)
+    
+    return property(getter, setter)
+
+
 class S3DFile(File):
     _type = 'S3D'
+    # approximate size of a parsed record, the object with its slots and
+    # the field values
+    _record_size = 250
+    
+    _chunks = ('HEAD', 'VERT', 'INDX', 'PRIM', 'MATS', 'ANIM', 'PROP', 'REGP')
     
-    def __init__(self, *args, **kwargs):
-        File.__init__(self, *args, **kwargs)
+    head = _chunk_property('HEAD', 'head')
+    vert = _chunk_property('VERT', 'vert')
+    vertices = _chunk_property('VERT', 'vertices')
+    indx = _chunk_property('INDX', 'indx')
+    indices = _chunk_property('INDX', 'indices')
+    prim = _chunk_property('PRIM', 'prim')
+    primitives = _chunk_property('PRIM', 'primitives')
+    mats = _chunk_property('MATS', 'mats')
+    materials = _chunk_property('MATS', 'materials')
+    anim = _chunk_property('ANIM', 'anim')
+    animations = _chunk_property('ANIM', 'animations')
+    prop = _chunk_property('PROP', 'prop')
+    properties = _chunk_property('PROP', 'properties')
+    regp = _chunk_property('REGP', 'regp')
+    effects = _chunk_property('REGP', 'effects')
+    
+    def __init__(self, data, lazy=True):
+        '''with lazy=True only the chunk offsets are read, every chunk is
+        parsed when one of its attributes is accessed the first time,
+        unparsed chunks are written back unchanged by raw()'''
+        File.__init__(self, data)
         
         self.header = None
-        self.head = None
-        self.vert = None
-        self.vertices = list()
-        self.indx = None
-        self.indices = list()
-        self.prim = None
-        self.primitives = list()
-        self.mats = None
-        self.materials = list()
-        self.anim = None
-        self.animations = list()
-        self.prop = None
-        self.properties = list()
-        self.regp = None
-        self.effects = list()
+        self._offsets = dict()
+        self._parsed = set()
         
         self._parse_s3d()
+        
+        if not lazy:
+            for chunk in self._chunks:
+                self._parse_chunk(chunk)
     
     def _parse_s3d(self):
         io = BytesIO(self.data)
         
         self.header = s3d.Header.parse(io)
-        self.head = s3d.Head.parse(io)
-
-        self.vert = s3d.Vert.parse(io)
-        enforce(self.vert.magic == 'VERT', ValueError, 'magic number mismatch')
-        for _ in xrange(self.vert.groups):
-            group = s3d.VertexGroup.parse(io)
+        
+        offset = io.tell()
+        for chunk in self._chunks:
+            magic, size = unpack_from('<4sI', self.data, offset)
+            enforce(magic == chunk, ValueError, 'magic number mismatch')
             
-            self.vertices.append((group, [s3d.Vertex.parse(io)
-                                          for _ in xrange(group.vertices)]))
+            self._offsets[chunk] = (offset, size)
+            offset += size
+    
+    def _parse_chunk(self, chunk):
+        io = BytesIO(self.data)
+        io.seek(self._offsets[chunk][0], SEEK_SET)
         
-        self.indx = s3d.Indx.parse(io)
-        enforce(self.indx.magic == 'INDX', ValueError, 'magic number mismatch')
-        for _ in xrange(self.indx.groups):
+        getattr(self, '_parse_' + chunk.lower())(io)
+        self._parsed.add(chunk)
+    
+    def _parse_head(self, io):
+        self._head = s3d.Head.parse(io)
+    
+    def _parse_vert(self, io):
+        self._vert = s3d.Vert.parse(io)
+        self._vertices = list()
+        for _ in xrange(self._vert.groups):
+            group = s3d.VertexGroup.parse(io)
+            
+            self._vertices.append((group, self._parse_records(s3d.Vertex, io,
+                                                              group.vertices)))
+    
+    def _parse_indx(self, io):
+        self._indx = s3d.Indx.parse(io)
+        self._indices = list()
+        for _ in xrange(self._indx.groups):
             group = s3d.IndexGroup.parse(io)
             
-            self.indices.append((group, [s3d.Index.parse(io)
-                                         for _ in xrange(group.vertices/3)]))
-        
-        self.prim = s3d.Prim.parse(io)
-        enforce(self.prim.magic == 'PRIM', ValueError, 'magic number mismatch')
-        for _ in xrange(self.prim.groups):
-            self.primitives.append(s3d.PrimGroup.parse(io))
-        
-        
-        self.mats = s3d.Mats.parse(io)
-        enforce(self.mats.magic == 'MATS', ValueError, 'magic number mismatch')
+            self._indices.append((group, self._parse_records(s3d.Index, io,
+                                                             group.vertices/3)))
+    
+    def _parse_prim(self, io):
+        self._prim = s3d.Prim.parse(io)
+        self._primitives = [s3d.PrimGroup.parse(io)
+                            for _ in xrange(self._prim.groups)]
+    
+    def _parse_mats(self, io):
+        self._mats = s3d.Mats.parse(io)
         Group = s3d.MaterialGTE15 if float(self.head.version) >= 1.5 \
                     else s3d.MaterialLT15
-        for _ in xrange(self.mats.groups):
-            self.materials.append(Group.parse(io))
+        self._materials = [Group.parse(io) for _ in xrange(self._mats.groups)]
+    
+    def _parse_anim(self, io):
+        self._anim = s3d.Anim.parse(io)
+        self._animations = [s3d.AnimationGroup.parse(io)
+                            for _ in xrange(self._anim.groups)]
+    
+    def _parse_prop(self, io):
+        self._prop = s3d.Prop.parse(io)
+        self._properties = [s3d.PropertyGroup.parse(io)
+                            for _ in xrange(self._prop.groups)]
+    
+    def _parse_regp(self, io):
+        self._regp = s3d.Regp.parse(io)
+        self._effects = list()
+        for _ in xrange(self._regp.effects):
+            group = s3d.EffectGroup.parse(io)
+            
+            self._effects.append((group, [s3d.Effect.parse(io)
+                                          for _ in xrange(group.effects)]))
+    
+    def _parse_records(self, cls, io, count):
+        # with numpy the vertices and indices are structured arrays which
+        # share the memory of the entry data, they're read-only, copy them
+        # to modify them
+        if _numpy() is None:
+            return cls.parse_many(io, count)
         
+        if not isinstance(self.data, str):
+            # a buffer into the mapping of a package, numpy would keep a raw
+            # pointer to memory which is unmapped when the package is closed
+            self.data = str(self.data)
         
-        self.anim = s3d.Anim.parse(io)
-        enforce(self.anim.magic == 'ANIM', ValueError, 'magic number mismatch')
-        for _ in xrange(self.anim.groups):
-            self.animations.append(s3d.AnimationGroup.parse(io))
+        records = cls.parse_array(self.data, count, io.tell())
+        io.seek(records.nbytes, SEEK_CUR)
         
-        self.prop = s3d.Prop.parse(io)
-        enforce(self.prop.magic == 'PROP', ValueError, 'magic number mismatch')
-        for _ in xrange(self.prop.groups):
-            self.properties.append(s3d.PropertyGroup.parse(io))
+        return records
+    
+    def memory_size(self):
+        records = 0
+        for chunk, groups in (('VERT', '_vertices'), ('INDX', '_indices'),
+                              ('REGP', '_effects')):
+            if chunk in self._parsed:
+                records += sum(len(records) for group, records in getattr(self, groups)
+                               if isinstance(records, list))
+        for chunk, items in (('PRIM', '_primitives'), ('MATS', '_materials'),
+                             ('ANIM', '_animations'), ('PROP', '_properties')):
+            if chunk in self._parsed:
+                records += len(getattr(self, items))
         
-        self.regp = s3d.Regp.parse(io)
-        enforce(self.regp.magic == 'REGP', ValueError, 'magic number mismatch')
-        for _ in xrange(self.regp.effects):
-            group = s3d.EffectGroup.parse(io)
+        return len(self.data) + records*self._record_size
+    
+    def _raw_chunk(self, chunk):
+        offset, size = self._offsets[chunk]
+        return str(buffer(self.data, offset, size))
+    
+    def raw(self):
+        raw = [self.header.raw()]
+        for chunk in self._chunks:
+            if chunk in self._parsed:
+                raw.append(getattr(self, '_raw_' + chunk.lower())())
+            else:
+                raw.append(self._raw_chunk(chunk))
+        
+        return ''.join(raw)
+    
+    def _raw_head(self):
+        return self.head.raw()
+    
+    def _raw_vert(self):
+        return self.vert.raw() + \
+               ''.join(group.raw() + _raw_records(vertices)
+                       for group,vertices in self.vertices)
+    
+    def _raw_indx(self):
+        return self.indx.raw() + \
+               ''.join(group.raw() + _raw_records(indices)
+                       for group,indices in self.indices)
+    
+    def _raw_prim(self):
+        return self.prim.raw() + ''.join(p.raw() for p in self.primitives)
+    
+    def _raw_mats(self):
+        return self.mats.raw() + ''.join(mat.raw() for mat in self.materials)
+    
+    def _raw_anim(self):
+        return self.anim.raw() + ''.join(a.raw() for a in self.animations)
+    
+    def _raw_prop(self):
+        return self.prop.raw() + ''.join(p.raw() for p in self.properties)
+    
+    def _raw_regp(self):
+        return self.regp.raw() + \
+               ''.join(group.raw() + ''.join(e.raw() for e in effects)
+                       for group,effects in self.effects)
+
+
+def _raw_records(records):
+    if hasattr(records, 'tobytes'):
+        return records.tobytes()
+    
+    return ''.join(record.raw() for record in records)
+
+
+# record id: squish flags, bytes per pixel or per 4x4 block for DXT
+_FSH_COMPRESSION = {0x60: squish.DXT1,
+                    0x61: squish.DXT3}
+_FSH_RECORD_IDS = dict((flags, record_id) for record_id, flags
+                       in _FSH_COMPRESSION.iteritems())
+_DXT_FORMATS = squish.DXT1 | squish.DXT3 | squish.DXT5
+_FSH_BYTES_PER_PIXEL = {0x60: 8,
+                        0x61: 16,
+                        0x7d: 4,
+                        0x7f: 3,
+                        0x7e: 2,
+                        0x78: 2,
+                        0x6d: 2}
+
+
+def _rgb565(color):
+    return ((color >> 11)*255 // 31, (color >> 5 & 63)*255 // 63,
+            (color & 31)*255 // 31)
+
+def _rgb1555(color):
+    return ((color >> 10 & 31)*255 // 31, (color >> 5 & 31)*255 // 31,
+            (color & 31)*255 // 31, 255 if color >> 15 else 0)
+
+def _rgb4444(color):
+    return ((color >> 8 & 15)*17, (color >> 4 & 15)*17, (color & 15)*17,
+            (color >> 12)*17)
+
+_FSH_16BIT = {0x78: lambda color: _rgb565(color) + (255,),
+              0x7e: _rgb1555,
+              0x6d: _rgb4444}
+
+def _rgba(pixels, record_id):
+    '''converts the pixels of an uncompressed fsh format to RGBA'''
+    if record_id in (0x7d, 0x7f):
+        # BGRA and BGR bytes
+        bpp = _FSH_BYTES_PER_PIXEL[record_id]
+        data = bytearray(pixels)
+        rgba = bytearray('\xff'*(len(data) // bpp*4))
+        for i in xrange(3):
+            rgba[i::4] = data[2 - i::bpp]
+        if bpp == 4:
+            rgba[3::4] = data[3::4]
+        return str(rgba)
+    
+    convert = _FSH_16BIT.get(record_id)
+    enforce(not convert is None, NotImplementedError, 'unknown fsh format')
+    
+    words = array('H', pixels)
+    if byteorder == 'big':
+        words.byteswap()
+    
+    rgba = bytearray()
+    for word in words:
+        rgba.extend(convert(word))
+    return str(rgba)
+
+def _dxt_block_colors(data, size, flags, step):
+    '''returns the RGBA of every step-th 4x4 block of DXT data, the average
+    of the two endpoint colors and for DXT3 the average alpha, DXT1 blocks
+    are opaque'''
+    width, height = ((n + 3) // 4 for n in size)
+    
+    words = array('H', data)
+    if byteorder == 'big':
+        words.byteswap()
+    
+    # a DXT3 block starts with 4 words of 4 bit alpha values
+    block = 4 if flags & squish.DXT1 else 8
+    color = block - 4
+    
+    pixels = bytearray()
+    for y in xrange(0, height, step):
+        for x in xrange(0, width, step):
+            i = (y*width + x)*block
             
-            self.effects.append((group, [s3d.Effect.parse(io)
-                                         for _ in xrange(group.effects)]))
+            r0, g0, b0 = _rgb565(words[i + color])
+            r1, g1, b1 = _rgb565(words[i + color + 1])
+            if color:
+                alpha = sum((w & 15) + (w >> 4 & 15) + (w >> 8 & 15) + (w >> 12)
+                            for w in words[i:i + 4])*17 // 16
+            else:
+                alpha = 255
             
+            pixels.extend(((r0 + r1) // 2, (g0 + g1) // 2, (b0 + b1) // 2, alpha))
     
-    def raw(self):
-        raw_vertices = ''.join(group.raw() + ''.join(v.raw() for v in vertices)
-                               for group,vertices in self.vertices)
-        raw_indices = ''.join(group.raw() + ''.join(i.raw() for i in indices)
-                              for group,indices in self.indices)
-        raw_primitives = ''.join(p.raw() for p in self.primitives)
-        raw_materials = ''.join(mat.raw() for mat in self.materials)
-        raw_animations = ''.join(a.raw() for a in self.animations)
-        raw_properties = ''.join(p.raw() for p in self.properties)
-        raw_effects = ''.join(group.raw() + ''.join(e.raw() for e in effects)
-                              for group,effects in self.effects)
-        
-        return ''.join([self.header.raw(), self.head.raw(),
-                        self.vert.raw(), raw_vertices,
-                        self.indx.raw(), raw_indices,
-                        self.prim.raw(), raw_primitives,
-                        self.mats.raw(), raw_materials,
-                        self.anim.raw(), raw_animations,
-                        self.prop.raw(), raw_properties,
-                        self.regp.raw(), raw_effects])
+    return (len(xrange(0, width, step)), len(xrange(0, height, step))), str(pixels)
+
+def _subsample(pixels, size, bpp, step):
+    '''returns every step-th pixel of every step-th row'''
+    width, height = size
+    row = width*bpp
+    
+    rows = list()
+    for y in xrange(0, height, step):
+        rows.extend(pixels[y*row + x*bpp:y*row + (x + 1)*bpp]
+                    for x in xrange(0, width, step))
+    
+    return (len(xrange(0, width, step)), len(xrange(0, height, step))), ''.join(rows)
 
 
 class ImageFile(File):
     _type = ('BMP', 'JPEG')
     
     def pil_image(self):
-        return Image.open(BytesIO(self.data))
+        return _pil().open(BytesIO(self.data))
          
 
+class FSHEntry(object):
+    '''an image of a FSH file, the pixels of every mipmap level are only
+    decoded when they're requested'''
+    def __init__(self, data, directory, header, offset, length):
+        self.directory = directory
+        self.header = header
+        
+        self._data = data
+        self._offset = offset
+        self._length = length
+        self._pixels = dict()
+        self.disk_cache = None
+    
+    @property
+    def size(self):
+        return (self.header.width, self.header.height)
+    
+    @property
+    def mipmaps(self):
+        return self.header.mipmaps
+    
+    @property
+    def compression(self):
+        return _FSH_COMPRESSION.get(self.header.record_id)
+    
+    def level_size(self, level=0):
+        enforce(0 <= level <= self.mipmaps, IndexError, 'no such mipmap level')
+        return (max(1, self.header.width >> level),
+                max(1, self.header.height >> level))
+    
+    def level_data(self, level=0):
+        '''returns the encoded data of a mipmap level'''
+        enforce(0 <= level <= self.mipmaps, IndexError, 'no such mipmap level')
+        
+        bpp = _FSH_BYTES_PER_PIXEL.get(self.header.record_id)
+        if bpp is None:
+            # unknown format, the levels can't be told apart
+            enforce(level == 0, NotImplementedError, 'unknown fsh format')
+            return str(buffer(self._data, self._offset, self._length))
+        
+        offset = self._offset
+        for i in xrange(level + 1):
+            width, height = self.level_size(i)
+            if not self.compression is None:
+                # DXT stores 4x4 blocks, bpp is the size of a block
+                length = max(1, (width + 3) // 4)*max(1, (height + 3) // 4)*bpp
+            else:
+                length = width*height*bpp
+            
+            if i < level:
+                offset += length
+        
+        return str(buffer(self._data, offset, length))
+    
+    def pixels(self, level=0):
+        '''returns the RGBA pixels of a DXT compressed mipmap level, other
+        formats are returned as they're stored'''
+        if not level in self._pixels and not self._load_pixels(level):
+            data = self.level_data(level)
+            
+            if not self.compression is None:
+                width, height = self.level_size(level)
+                data = squish.decompress_image(data, width, height,
+                                               self.compression)
+                self._store_pixels(level, data)
+            
+            self._pixels[level] = data
+        
+        return self._pixels[level]
+    
+    def _pixels_key(self, level):
+        return self.disk_cache.key(self.level_data(level),
+                                   'rgba%d' % self.compression)
+    
+    def _load_pixels(self, level):
+        # only DXT images are cached, the other formats aren't decoded
+        if self.disk_cache is None or self.compression is None:
+            return False
+        
+        pixels = self.disk_cache.get(self._pixels_key(level))
+        if not pixels is None:
+            self._pixels[level] = pixels
+        
+        return not pixels is None
+    
+    def _store_pixels(self, level, pixels):
+        if not self.disk_cache is None:
+            self.disk_cache.put(self._pixels_key(level), pixels)
+    
+    def pil_image(self, level=0):
+        return _pil().fromstring('RGBA', self.level_size(level), self.pixels(level))
+    
+    def thumbnail(self, max_size):
+        '''returns the size and pixels of a preview which fits into a
+        max_size square, the first mipmap which fits is decoded, if none
+        does the smallest level is reduced, DXT images by averaging the
+        endpoint colors of their blocks, which is never fully decoded, the
+        pixels are RGBA in every format'''
+        for level in xrange(self.mipmaps + 1):
+            size = self.level_size(level)
+            if max(size) <= max_size:
+                if self.compression is None:
+                    return size, _rgba(self.level_data(level), self.header.record_id)
+                return size, self.pixels(level)
+        
+        level = self.mipmaps
+        size = self.level_size(level)
+        # the step to fit the larger side into max_size
+        step = lambda n: (n + max_size - 1) // max_size
+        
+        if not self.compression is None:
+            blocks = max((n + 3) // 4 for n in size)
+            if blocks >= max_size:
+                return _dxt_block_colors(self.level_data(level), size,
+                                         self.compression, step(blocks))
+            
+            # the blocks alone are too coarse, the level is small enough to
+            # be decoded
+            return _subsample(self.pixels(level), size, 4, step(max(size)))
+        
+        bpp = _FSH_BYTES_PER_PIXEL.get(self.header.record_id)
+        enforce(not bpp is None, NotImplementedError, 'unknown fsh format')
+        size, pixels = _subsample(self.level_data(level), size, bpp, step(max(size)))
+        return size, _rgba(pixels, self.header.record_id)
+    
+    def memory_size(self):
+        return sum(len(pixels) for pixels in self._pixels.itervalues())
+
+
 class FSHFile(ImageFile):
     _type = 'FSH'
     
-    def __init__(self, *args, **kwargs):
-        File.__init__(self, *args, **kwargs)
+    def __init__(self, data):
+        '''only the headers are parsed, the pixels are decoded when data,
+        pixels or pil_image are used'''
+        self._raw = data
+        self._data = None
         
         self.header = None
         self.directory = None
+        self.directories = list()
         self.entry_header = None
+        self.entries = list()
         
         self._parse_fsh()
     
     def _parse_fsh(self):
-        io = BytesIO(self.data)
+        io = BytesIO(self._raw)
         
         self.header = fsh.Header.parse(io)
         enforce(self.header.magic == 'SHPI', ValueError, 'magic number mismatch')
-        self.directory = fsh.Directory.parse(io)
-        io.seek(self.directory.offset, SEEK_SET)
+        self.directories = fsh.Directory.parse_many(io, self.header.entry_count)
+        enforce(self.directories, ValueError, 'fsh file without entries')
         
-        self.entry_header = fsh.EntryHeader.parse(io)
+        offsets = sorted(directory.offset for directory in self.directories)
+        for directory in self.directories:
+            io.seek(directory.offset, SEEK_SET)
+            header = fsh.EntryHeader.parse(io)
+            
+            # the image ends at the first attachment, the next entry or the
+            # end of the file
+            offset = directory.offset + fsh.EntryHeader._struct.size
+            if header.size:
+                end = directory.offset + header.size
+            else:
+                end = next((o for o in offsets if o > directory.offset),
+                           len(self._raw))
+            
+            self.entries.append(FSHEntry(self._raw, directory, header,
+                                         offset, end - offset))
+        
+        self.directory = self.directories[0]
+        self.entry_header = self.entries[0].header
+    
+    @classmethod
+    def decode_many(cls, files, level=0, workers=None):
+        '''decodes the mipmap level of every DXT compressed entry of files,
+        which are FSHFile objects or raw FSH data, with a pool of threads,
+        the decoded pixels are kept on the entries, returns the FSHFiles'''
+        files = [f if isinstance(f, FSHFile) else cls(f) for f in files]
+        
+        entries = [entry for f in files for entry in f.entries
+                   if not entry.compression is None and
+                   level <= entry.mipmaps and not level in entry._pixels and
+                   not entry._load_pixels(level)]
+        images = [(entry.level_data(level),) + entry.level_size(level) +
+                  (entry.compression,) for entry in entries]
         
-        enforce(self.entry_header.size == 0, ValueError,
-                'corrupt fsh file or unimplemented feauture')
-        compression = None
-        if self.entry_header.record_id == 0x60:
-            compression = squish.DXT1
-        elif self.entry_header.record_id == 0x61:
-            compression = squish.DXT3
+        for entry, pixels in izip(entries, squish.decompress_images(images, workers)):
+            entry._pixels[level] = pixels
+            entry._store_pixels(level, pixels)
         
-        if not compression is None:
-            self.data = squish.decompress_image(io.read(), self.entry_header.width,
-                                                           self.entry_header.height,
-                                                compression)
+        return files
     
-    def raw(self):
-        self.directory.offset = fsh.Header._struct.size + \
-                                fsh.Directory._struct.size
-                                
-        compression = None
-        if self.entry_header.record_id == 0x60:
-            compression = squish.DXT1
-        elif self.entry_header.record_id == 0x61:
-            compression = squish.DXT3
-        
-        if not compression is None:
-            data = squish.compress_image(self.data, self.entry_header.width,
-                                                    self.entry_header.height,
+    def set_disk_cache(self, cache):
+        for entry in self.entries:
+            entry.disk_cache = cache
+    
+    def entry(self, index=0):
+        return self.entries[index]
+    
+    def pixels(self, entry=0, level=0):
+        return self.entries[entry].pixels(level)
+    
+    @property
+    def data(self):
+        '''the pixels of the first entry, setting them replaces the image'''
+        if self._data is None:
+            self._data = self.entries[0].pixels()
+        return self._data
+    
+    @data.setter
+    def data(self, data):
+        self._data = data
+    
+    def raw(self, flags=None):
+        '''flags are squish flags used to encode a DXT image, a DXT format,
+        which changes the record id, and/or one of the COLOR_* fit flags to
+        trade quality for speed, by default the image is encoded like the
+        first entry
+        
+        the first entry is encoded without its mipmaps, the pixels of the
+        other entries are copied as they are, the headers are written as
+        they're set'''
+        encode = not self._data is None or not flags is None
+        if not encode and not self._headers_changed():
+            return str(self._raw)
+        
+        # the headers are copied, the entries still describe the data they
+        # were parsed from
+        header = fsh.Header(*self.header._data.values())
+        entry_header = fsh.EntryHeader(*self.entry_header._data.values())
+        
+        compression = self.entries[0].compression
+        if not flags is None:
+            enforce(not compression is None, ValueError,
+                    'only DXT images can be encoded with squish flags')
+            if not flags & _DXT_FORMATS:
+                flags |= compression
+            
+            record_id = _FSH_RECORD_IDS.get(flags & _DXT_FORMATS)
+            enforce(not record_id is None, ValueError,
+                    'DXT format not supported by fsh')
+            entry_header.record_id = record_id
+            compression = flags
+        
+        if not encode:
+            data = None
+        elif not compression is None:
+            data = squish.compress_image(self.data, entry_header.width,
+                                                    entry_header.height,
                                          compression)
         else:
-            data = self.data        
-              
-        return ''.join([self.header.raw(), self.directory.raw(),
-                        self.entry_header.raw(), data])
+            data = self.data
+        
+        if encode:
+            # only the first level is written
+            entry_header.mipmaps = 0
+        
+        # an entry ends at the next entry or the end of the file
+        offsets = sorted(directory.offset for directory in self.directories)
+        blocks = list()
+        for entry in self.entries:
+            start = entry.directory.offset
+            end = next((o for o in offsets if o > start), len(self._raw))
+            
+            if entry is self.entries[0] and encode:
+                # attachments follow the image if the entry has a size
+                attachments = ''
+                if entry.header.size:
+                    attachments = str(buffer(self._raw, start + entry.header.size,
+                                             end - start - entry.header.size))
+                    entry_header.size = fsh.EntryHeader._struct.size + len(data)
+                blocks.append(entry_header.raw() + str(data) + attachments)
+            else:
+                skip = fsh.EntryHeader._struct.size
+                blocks.append(entry.header.raw() +
+                              str(buffer(self._raw, start + skip, end - start - skip)))
+        
+        offset = fsh.Header._struct.size + \
+                 len(self.directories)*fsh.Directory._struct.size
+        directories = list()
+        for directory, block in izip(self.directories, blocks):
+            directory = fsh.Directory(*directory._data.values())
+            directory.offset = offset
+            directories.append(directory.raw())
+            offset += len(block)
+        
+        header.file_size = offset
+        
+        return ''.join([header.raw()] + directories + blocks)
+    
+    def _headers_changed(self):
+        # the parsed headers are public and can be edited in place
+        if not self.header.raw() == str(buffer(self._raw, 0, fsh.Header._struct.size)):
+            return True
+        
+        offset = fsh.Header._struct.size
+        for directory in self.directories:
+            if not directory.raw() == str(buffer(self._raw, offset, fsh.Directory._struct.size)):
+                return True
+            offset += fsh.Directory._struct.size
+        
+        return any(not entry.header.raw() ==
+                   str(buffer(self._raw, entry.directory.offset, fsh.EntryHeader._struct.size))
+                   for entry in self.entries)
+    
+    def memory_size(self):
+        decoded = sum(entry.memory_size() for entry in self.entries)
+        if not self._data is None and not self._data is self.entries[0]._pixels.get(0):
+            decoded += len(self._data)
+        
+        return len(self._raw) + decoded
     
     @property
     def size(self):
         return (self.entry_header.width, self.entry_header.height)
     
-    def pil_image(self):
-        return Image.fromstring('RGBA', self.size, self.data)
-
-
+    def pil_image(self, entry=0, level=0):
+        if entry == 0 and level == 0:
+            return _pil().fromstring('RGBA', self.size, self.data)
+        
+        return self.entries[entry].pil_image(level)
+    
+    def thumbnail(self, max_size, entry=0):
+        '''returns a preview of an entry which fits into a max_size square
+        without decoding the full image, see FSHEntry.thumbnail'''
+        return _pil().fromstring('RGBA', *self.entries[entry].thumbnail(max_size))
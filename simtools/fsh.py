@@ -18,7 +18,7 @@ class Directory(BaseStruct):
     
 
 class EntryHeader(BaseStruct):
-    _struct = Struct('<b3b6H')
+    _struct = Struct('<4B6H')
     _fields = ['record_id',
                'size1',
                'size2',
@@ -38,4 +38,13 @@ class EntryHeader(BaseStruct):
     def size(self, value):
         self.size1 = value >> 16
         self.size2 = (value >> 8) & 0xff
-        self.size3 = value & 0xff
\ No newline at end of file
+        self.size3 = value & 0xff
+    
+    @property
+    def mipmaps(self):
+        '''the number of mipmaps is stored in the upper 4 bits of y_top'''
+        return self.y_top >> 12
+    
+    @mipmaps.setter
+    def mipmaps(self, value):
+        self.y_top = (self.y_top & 0x0fff) | (value << 12)
@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from itertools import izip, repeat
+from threading import RLock
+from struct import error as StructError
+import os
+
+from simtools import DBPF
+
+
+# extensions of the files the game loads as packages
+EXTENSIONS = ('.dat', '.sc4desc', '.sc4lot', '.sc4model')
+
+
+def load_order(path):
+    '''yields the packages in path in the order the game loads them, the
+    files of a directory in alphabetical order, then its subdirectories'''
+    names = sorted(os.listdir(path), key=lambda name: name.lower())
+    
+    directories = list()
+    for name in names:
+        full = os.path.join(path, name)
+        if os.path.isdir(full):
+            directories.append(full)
+        elif os.path.splitext(name)[1].lower() in EXTENSIONS:
+            yield full
+    
+    for directory in directories:
+        for package in load_order(directory):
+            yield package
+
+
+class PackageSet(object):
+    '''one index over many packages, a resource in a package loaded later
+    overrides the same type, group and instance of the packages before it
+    
+    the index is built once, packages are only opened to read the winning
+    entries, at most max_open of them are kept open, with an IndexCache
+    only new and changed packages are parsed'''
+    def __init__(self, paths, max_open=64, mmap=False, cache_size=None,
+                       disk_cache=None, index_cache=None):
+        self.paths = list()
+        self.invalid = list()
+        self.max_open = max_open
+        
+        self.index_cache = index_cache
+        self._options = dict(mmap=mmap, cache_size=cache_size,
+                             disk_cache=disk_cache, index_cache=index_cache)
+        # key: position of the winning package in paths
+        self._index = dict()
+        # key: positions of the overridden packages, in load order
+        self._overridden = dict()
+        
+        self._packages = OrderedDict()
+        self._lock = RLock()
+        
+        for path in paths:
+            self._add(path)
+    
+    @classmethod
+    def from_directory(cls, path, **kwargs):
+        '''opens all packages in path and its subdirectories in load order'''
+        return cls(load_order(path), **kwargs)
+    
+    def _add(self, path):
+        try:
+            package = DBPF.open(path, index_cache=self.index_cache)
+        except (IOError, ValueError, StructError, NotImplementedError):
+            # not a package, truncated or of an unknown index version
+            self.invalid.append(path)
+            return
+        
+        with package:
+            columns = package.indices.columns
+            keys = [columns['type_id'], columns['group_id'], columns['instance_id'],
+                    columns.get('instance2_id', repeat(0))]
+            
+            number = len(self.paths)
+            self.paths.append(path)
+            
+            for key in izip(*keys):
+                if key[0] == 0xe86b1eef:
+                    continue
+                
+                previous = self._index.get(key)
+                if not previous is None and not previous == number:
+                    self._overridden.setdefault(key, list()).append(previous)
+                self._index[key] = number
+    
+    def package(self, number):
+        '''returns the opened package at position number of paths, the least
+        recently used package is closed when more than max_open are open'''
+        with self._lock:
+            try:
+                package = self._packages.pop(number)
+            except KeyError:
+                package = DBPF.open(self.paths[number], **self._options)
+                
+                while len(self._packages) >= self.max_open:
+                    _, evicted = self._packages.popitem(last=False)
+                    evicted.close()
+            
+            self._packages[number] = package
+            
+            return package
+    
+    def _key(self, type_id, group_id, instance_id, instance2_id):
+        return (type_id, group_id, instance_id, instance2_id or 0)
+    
+    def locate(self, type_id, group_id, instance_id, instance2_id=None,
+                     default=None):
+        '''returns the path of the package the resource is loaded from'''
+        number = self._index.get(self._key(type_id, group_id, instance_id,
+                                           instance2_id))
+        return default if number is None else self.paths[number]
+    
+    def get(self, type_id, group_id, instance_id, instance2_id=None, default=None):
+        '''returns the index of the winning entry, it can only be opened
+        as long as its package is one of the max_open packages, default if
+        the package no longer has the entry since it changed on disk'''
+        key = self._key(type_id, group_id, instance_id, instance2_id)
+        
+        number = self._index.get(key)
+        if number is None:
+            return default
+        
+        package = self.package(number)
+        if package.header.index_version == '7.0':
+            key = key[:3]
+        
+        position = package.indices.find(key)
+        if position is None:
+            return default
+        
+        return package.indices[position]
+    
+    def open(self, type_id, group_id, instance_id, instance2_id=None):
+        '''decodes the winning entry of the resource'''
+        with self._lock:
+            index = self.get(type_id, group_id, instance_id, instance2_id)
+            if index is None:
+                raise KeyError((type_id, group_id, instance_id, instance2_id))
+            
+            return index.open()
+    
+    def conflicts(self):
+        '''yields (key, paths) for every resource provided by more than one
+        package, paths are in load order, the last one wins'''
+        for key, overridden in self._overridden.iteritems():
+            yield key, [self.paths[number]
+                        for number in overridden + [self._index[key]]]
+    
+    def close(self):
+        with self._lock:
+            for package in self._packages.itervalues():
+                package.close()
+            self._packages.clear()
+    
+    def __len__(self):
+        return len(self._index)
+    
+    def __iter__(self):
+        return iter(self._index)
+    
+    def __contains__(self, key):
+        if len(key) == 3:
+            key += (0,)
+        return key in self._index
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
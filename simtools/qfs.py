@@ -1,78 +1,129 @@
-from struct import pack, unpack
-from io import BytesIO
+from struct import pack, unpack, unpack_from
 from collections import namedtuple
+from array import array
+
+from simtools.ext import qfs as native
+from simtools.util import enforce
 
 FileHeader = namedtuple('FileHeader', ['compressed_size', 'magic', 'size'])
 
 def decompress(data):
-    if not hasattr(data, 'read'):
-        data = BytesIO(data)
+    if hasattr(data, 'read'):
+        header = unpack('<IH3B', data.read(9))
+        body = data.read(header[0] - 9)
+    else:
+        header = unpack_from('<IH3B', data)
+        body = buffer(data, 9, header[0] - 9)
     
-    header = unpack('<IH3B', data.read(9))
     compressed_size = header[0]
     magic = header[1]
     assert(magic == 0xfb10)
-    size = (header[2] << 16 | header[3] << 8 | header[4] << 8)
+    size = (header[2] << 16 | header[3] << 8 | header[4])
+    
+    if not native._libqfs() is None:
+        return (FileHeader(compressed_size, magic, size),
+                native.decompress(body, size))
     
     return (FileHeader(compressed_size, magic, size),
-            _decompress(data, compressed_size-9, size))
+            _decompress(body, size))
     
 
-def _decompress(fileobj, length, uncompressed_size):
-    result = ''
+def _decompress(data, uncompressed_size):
+    data = bytearray(data)
+    result = bytearray(uncompressed_size)
     
-    while length > 0 and len(result) < uncompressed_size:
-        opcode, = unpack('<B', fileobj.read(1))
-        length -= 1
+    pos = 0
+    end = len(data)
+    written = 0
+    
+    while pos < end and written < uncompressed_size:
+        opcode = data[pos]
         
         if opcode < 0x80:
-            byte1, = unpack('<B', fileobj.read(1))
-            length -= 1
+            enforce(pos + 2 <= end, ValueError, 'corrupt compressed data')
+            byte1 = data[pos+1]
+            pos += 2
             
             numplain = opcode & 0x03 # last two
             numcopy = ((opcode & 0x1c) >> 2) + 3 # XXX00 -> XXX+3; min=3, max=10
             offset = ((opcode & 0x60) << 3) + byte1 + 1 # 67 bit opcode, byte1 + 1; min=1, max=1024
         elif opcode < 0xc0:
-            byte1, byte2 = unpack('<2B', fileobj.read(2))
-            length -= 2
+            enforce(pos + 3 <= end, ValueError, 'corrupt compressed data')
+            byte1, byte2 = data[pos+1], data[pos+2]
+            pos += 3
             
             numplain = ((byte1 & 0xc0) >> 6) # upper two bits
             numcopy = (opcode & 0x3f) + 4 # last 6 bits of opcode; min=4; max=67
             offset = ((byte1 & 0x3f) << 8) + byte2 + 1 # last 6 bits of byte 1, + byte2 +1; min=1, max=163848
         elif opcode < 0xe0: # last two = plain
-            byte1, byte2, byte3 = unpack('<3B', fileobj.read(3))
-            length -= 3
+            enforce(pos + 4 <= end, ValueError, 'corrupt compressed data')
+            byte1, byte2, byte3 = data[pos+1], data[pos+2], data[pos+3]
+            pos += 4
             
             numplain = opcode & 0x03 # last two
             numcopy = ((opcode & 0x0c) << 6) + byte3 + 5 # XX00 -> XXbyte3+5; min=5, max=1028
             offset = ((opcode & 0x10) << 12) + (byte1 << 8) + byte2 + 1 # min=1, max=131072
         elif opcode < 0xfc: # lower 3 bits + 4
+            pos += 1
+            
             numplain = ((opcode & 0x1f) << 2) + 4
-            #numplain = (opcode - 0xdf) * 4
             numcopy = 0
-            offset = 0
         else: # last two bits
+            pos += 1
+            
             numplain = opcode & 0x03
-            #numplain = opcode - 0xfc
             numcopy = 0
-            offset = 0
         
         if numplain:
-            result += fileobj.read(numplain)
-            length -= numplain
+            enforce(pos + numplain <= end and written + numplain <= uncompressed_size,
+                    ValueError, 'corrupt compressed data')
+            
+            result[written:written+numplain] = data[pos:pos+numplain]
+            pos += numplain
+            written += numplain
         
         if numcopy:
-            fromoffset = len(result) - (offset) # offset = 0, means last character
-                
-            for i in xrange(numcopy):
-                result += result[fromoffset+i]
-        
-    return result
+            fromoffset = written - offset # offset = 1, means last character
+            enforce(fromoffset >= 0 and written + numcopy <= uncompressed_size,
+                    ValueError, 'corrupt compressed data')
+            
+            # the source may overlap the destination, every chunk doubles
+            # the amount of bytes which can be copied at once
+            while numcopy:
+                chunk = min(numcopy, written - fromoffset)
+                result[written:written+chunk] = result[fromoffset:fromoffset+chunk]
+                written += chunk
+                numcopy -= chunk
+    
+    enforce(written == uncompressed_size, ValueError, 'truncated compressed data')
+    
+    return str(result)
+
+
+# compression levels: (maximum hash chain length, match length at which
+# the search stops)
+LEVELS = {1: (4, 32),
+          2: (8, 64),
+          3: (16, 128),
+          4: (32, 256),
+          5: (64, 512),
+          6: (128, 1028),
+          7: (256, 1028),
+          8: (1024, 1028),
+          9: (4096, 1028)}
+DEFAULT_LEVEL = 6
 
+MIN_MATCH = 3
+MAX_MATCH = 1028
+WINDOW = 131072
 
-def try_compress(data):
+
+def try_compress(data, level=DEFAULT_LEVEL):
+    # an unknown level is an error of the caller, not of the data
+    enforce(level in LEVELS, ValueError, 'unknown compression level')
+    
     try:
-        compressed = compress(data)
+        compressed = compress(data, level)
     except ValueError:
         compressed = None
         
@@ -82,130 +133,159 @@ def try_compress(data):
         return True, compressed
         
 
-def compress(data):
+def compress(data, level=DEFAULT_LEVEL):
     if hasattr(data, 'read'):
         data = data.read()
+    data = str(data)
     
-    compressed = _compress(data)
+    enforce(level in LEVELS, ValueError, 'unknown compression level')
+    enforce(len(data) <= 0xffffff, ValueError, 'data too large to compress')
+    
+    compressed = _compress(data, level)
     compressed_size = len(compressed) + 9 # 9 = size of header
     magic = 0xfb10
-    size = len(data) & 0xffffff
+    size = len(data)
     header = pack('<IH3B', compressed_size, magic,
                   (size & 0xff0000) >> 16, (size & 0x00ff00) >> 8, size & 0x0000ff)
     
     return ''.join([header, compressed])
 
-def _compress(data): # TODO: Fix me
-    # lz77 algorithm based on (14.6.2012):
-    # https://github.com/olle/lz77-kit/blob/master/src/main/python/lz77.py
-    # which is licensed under MIT
-    result = ''
-    buf = ''
+
+def _compress(data, level=DEFAULT_LEVEL):
+    # lz77 with hash chains, every position is inserted into the chain of
+    # its first three bytes, the chains are walked from the nearest position
+    max_chain, nice_length = LEVELS[level]
     
-    min_match_length = 3
-    max_string_length = 10
-    window_length = 1023
-    best_match_length = 0
+    result = list()
+    head = dict()
+    chain = array('i', [-1]) * len(data)
     
     pos = 0
+    literal = 0 # start of the pending plain bytes
     end = len(data)
     
-
     while pos < end:
-        match_length = min_match_length
-        search_start = max(pos - window_length, 0)
-        best_match_distance = max_string_length
-        best_match_length = 0
+        best_length = 0
+        best_offset = 0
         
-        found_match = False
+        key = data[pos:pos+MIN_MATCH]
+        candidate = head.get(key, -1)
+        limit = min(MAX_MATCH, end - pos)
+        tries = max_chain
         
-        while (search_start + match_length) < pos:
-            m1 = data[search_start:search_start + match_length]
-            m2 = data[pos:pos + match_length]
+        while candidate >= 0 and tries and pos - candidate <= WINDOW:
+            offset = pos - candidate
             
-            is_valid_match = (m1 == m2 and match_length < max_string_length)
-            
-            if is_valid_match:
-                match_length += 1
-                found_match = True
-            else:
-                real_match_length = match_length - 1
+            # only extend candidates which can beat the current best match
+            if data[candidate+best_length:candidate+best_length+1] == \
+                    data[pos+best_length:pos+best_length+1]:
+                length = _match_length(data, candidate, pos, limit)
                 
-                if found_match and real_match_length > best_match_length:
-                    best_match_distance = pos - search_start - real_match_length
-                    best_match_length = real_match_length
+                if length > best_length and _encodable(offset, length):
+                    best_length = length
+                    best_offset = offset
                     
-                match_length = min_match_length
-                search_start += 1
-                found_match = False
+                    if length >= nice_length:
+                        break
+            
+            candidate = chain[candidate]
+            tries -= 1
+        
+        if best_length:
+            result.extend(_output_plain(data[literal:pos]))
+            plain = data[pos - (pos - literal) % 4:pos]
+            result.extend(_output_offset(best_offset, best_length, plain))
             
-        new_compressed = ''
-        if best_match_length:
-            if buf:
-                new_compressed = ''.join(_output_plain(buf))
-                buf = ''
+            stop = pos + best_length
+            while pos < stop:
+                key = data[pos:pos+MIN_MATCH]
+                chain[pos] = head.get(key, -1)
+                head[key] = pos
+                pos += 1
             
-            new_compressed += ''.join(_output_offset(best_match_distance+best_match_length, best_match_length))
-            pos += best_match_length
+            literal = pos
         else:
-            buf += data[pos]
+            chain[pos] = head.get(key, -1)
+            head[key] = pos
             pos += 1
-        
-        result += new_compressed
     
-    result += ''.join(_output_plain(buf))
+    result.extend(_output_plain(data[literal:]))
+    result.extend(_output_end(data[end - (end - literal) % 4:end]))
+    
+    return ''.join(result)
+
+
+def _match_length(data, a, b, limit):
+    '''returns the length of the common prefix of data[a:] and data[b:],
+    at most limit'''
+    length = 0
+    
+    # compare in blocks first, slices are a lot faster than single bytes
+    while length + 32 <= limit and \
+            data[a+length:a+length+32] == data[b+length:b+length+32]:
+        length += 32
+    
+    while length < limit and data[a+length] == data[b+length]:
+        length += 1
     
-    return result
+    return length
+
+
+def _encodable(offset, length):
+    return (length >= 3 and offset <= 1024) or \
+           (length >= 4 and offset <= 16384) or \
+           (length >= 5 and offset <= 131072)
 
 
 def _output_plain(buf):
-    sizes = [28, 24, 20, 16, 12, 8, 4, 3, 2, 1]
-    
-    while len(buf):
-        for size in sizes:
-            if size <= len(buf):
-                data = buf[:size]
-                if size < 4:
-                    yield ''.join([pack('<B', 0xfc + len(data)), data])
-                else:
-                    yield ''.join([pack('<B', 0xe0 | ((len(data) - 4) >> 2)), data])                
-                
-                buf = buf[size:]
-                break
+    '''yields plain opcodes for buf, the last len(buf) % 4 bytes are left
+    over and have to be attached to the following opcode'''
+    end = len(buf) - len(buf) % 4
+    
+    for start in xrange(0, end, 112):
+        data = buf[start:min(start + 112, end)]
+        yield ''.join([pack('<B', 0xe0 | ((len(data) - 4) >> 2)), data])
+
+
+def _output_end(plain=''):
+    yield ''.join([pack('<B', 0xfc | len(plain)), plain])
+
+    
+def _output_offset(offset, length, plain=''):
+    numplain = len(plain)
     
-def _output_offset(offset, length):
     if 2 < length <= 10 and offset <= 1024:
         lower = (length - 3) << 2
         
         x = offset - 1
         byte1 = x & 0xff
-        upper = x >> 8
+        upper = (x >> 3) & 0x60
         
-        opcode = (upper << 5) | lower
+        opcode = upper | lower | numplain
         opcode = pack('<B', opcode)
         bytes = pack('<B', byte1)        
-    elif 3 < length <= 67 and offset <= 163848:
+    elif 3 < length <= 67 and offset <= 16384:
         opcode = (length - 4) & 0x3f | 0x80
         opcode = pack('<B', opcode)
         
         x = offset - 1
         byte2 = x & 0xff
-        byte1 = (x >> 8) & 0x3f
+        byte1 = (x >> 8) & 0x3f | numplain << 6
         bytes = pack('<BB', byte1, byte2)
     elif 4 < length <= 1028 and offset <= 131072:
         x = length - 5
         byte3 = x & 0xff
-        lower = (x >> 8) & 0x0c
+        lower = (x >> 6) & 0x0c
         
         x = offset - 1
         byte2 = x & 0xff
         byte1 = (x >> 8) & 0xff
-        upper = (x >> 16) & 0x10
+        upper = (x >> 12) & 0x10
         
-        opcode = upper | lower | 0xc0
+        opcode = upper | lower | 0xc0 | numplain
         opcode = pack('<B', opcode)
         bytes = pack('<BBB', byte1, byte2, byte3)        
     else:
         raise ValueError('failed to compress data')
     
-    yield ''.join([opcode, bytes])
+    yield ''.join([opcode, bytes, plain])
@@ -0,0 +1,97 @@
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore, local, Lock
+
+
+class Busy(Exception):
+    '''raised when max_pending requests are in flight'''
+
+
+class AsyncReader(object):
+    '''serves entries of a package from a pool of threads, requests return
+    an AsyncResult right away, which can be waited on or passed a callback,
+    so a server thread or event loop never blocks on reading, decompressing
+    or decoding an entry
+    
+    every thread reads through its own handle of the package, at most
+    max_pending requests are in flight, further requests raise Busy, so the
+    caller can reject or retry them, or with block=True wait until one
+    finished'''
+    def __init__(self, package, workers=None, max_pending=None):
+        self.package = package
+        
+        workers = workers or cpu_count()
+        self._pool = ThreadPool(workers)
+        self.max_pending = max_pending or workers*4
+        self._pending = BoundedSemaphore(self.max_pending)
+        
+        self._local = local()
+        self._handles = list()
+        self._lock = Lock()
+    
+    def _handle(self):
+        # the mapping is shared, only reads through a file need a handle
+        if not self.package._mmap is None:
+            return None
+        
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = open(self.package._fileobj.name, 'rb')
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        
+        return handle
+    
+    def _open(self, index, decode):
+        try:
+            file = index.open(self._handle())
+            if decode and hasattr(file, 'pixels'):
+                # decodes the first image of a FSH file
+                file.pixels()
+            return file
+        finally:
+            self._pending.release()
+    
+    def open(self, index, callback=None, decode=False, block=False):
+        '''decodes the entry of index in a worker, with decode=True the
+        pixels of FSH files are decoded too, callback is called with the
+        file once it is ready, raises Busy if max_pending requests are in
+        flight, with block=True it waits instead'''
+        if not self._pending.acquire(block):
+            raise Busy('{} requests pending'.format(self.max_pending))
+        
+        try:
+            return self._pool.apply_async(self._open, (index, decode),
+                                          callback=callback)
+        except:
+            self._pending.release()
+            raise
+    
+    def get(self, type_id, group_id, instance_id, instance2_id=None,
+                  callback=None, decode=False, block=False):
+        '''like open with the index of the entry with the given type, group
+        and instance (and instance2 for 7.1 packages), raises KeyError if
+        there is no such entry'''
+        index = self.package.get(type_id, group_id, instance_id, instance2_id)
+        if index is None:
+            raise KeyError((type_id, group_id, instance_id, instance2_id))
+        
+        return self.open(index, callback, decode, block)
+    
+    def close(self):
+        '''waits for all requests and closes the handles, the package is
+        left open'''
+        self._pool.close()
+        self._pool.join()
+        
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            del self._handles[:]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -1,10 +1,86 @@
 from struct import Struct
 from collections import OrderedDict
-from itertools import izip_longest
+from itertools import izip
+from operator import attrgetter
 from io import BufferedIOBase
+from os import SEEK_SET
+import os
+import re
+
+# numpy is optional and only imported when the first array is created
+numpy = None
+_numpy_imported = False
+
+
+def _numpy():
+    '''returns the numpy module or None if it isn't installed'''
+    global numpy, _numpy_imported
+    
+    if not _numpy_imported:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_imported = True
+    
+    return numpy
+
+
+class StructMeta(type):
+    '''stores the fields of a struct in __slots__, the slot descriptors
+    are the accessors of the fields, no per instance dict is needed'''
+    def __new__(mcs, name, bases, namespace):
+        inherited = set()
+        for base in bases:
+            for cls in base.__mro__:
+                inherited.update(getattr(cls, '__slots__', ()))
+        
+        fields = namespace.get('_fields', None)
+        if fields is None:
+            fields = next((base._fields for base in bases
+                           if hasattr(base, '_fields')), [])
+        
+        slots = list(namespace.get('__slots__', ()))
+        slots.extend(field for field in fields
+                     if not field in inherited and not field in slots)
+        namespace['__slots__'] = tuple(slots)
+        
+        cls = type.__new__(mcs, name, bases, namespace)
+        cls._values = staticmethod(_values_getter(fields))
+        cls._set_values = staticmethod(_values_setter(fields))
+        
+        return cls
+
+
+def _values_getter(fields):
+    # attrgetter only returns a tuple for more than one field
+    if not fields:
+        return lambda struct: ()
+    elif len(fields) == 1:
+        getter = attrgetter(fields[0])
+        return lambda struct: (getter(struct),)
+    
+    return attrgetter(*fields)
+
+
+def _values_setter(fields):
+    # generated like the accessors of namedtuple, a plain function with one
+    # assignment per field is a lot faster than a setattr loop
+    arguments = ''.join(', _{}=None'.format(i) for i in xrange(len(fields)))
+    body = ''.join('\n    struct.{} = _{}'.format(field, i)
+                   for i, field in enumerate(fields))
+    
+    namespace = dict()
+    exec 'def set_values(struct{}):\n    pass{}'.format(arguments, body) in namespace
+    
+    return namespace['set_values']
 
 
 class BaseStruct(object):
+    __metaclass__ = StructMeta
+    # __dict__ is only created when an attribute besides the fields is set
+    __slots__ = ('_fileobj', '__dict__')
+    
     _struct = Struct('')
     _fields = []
 
@@ -15,10 +91,7 @@ class BaseStruct(object):
         else:
             self._fileobj = None
         
-        self._data = OrderedDict()
-
-        for arg, value in izip_longest(self._fields, args, fillvalue=None):
-            self._data[arg] = value
+        self._set_values(self, *args[:len(self._fields)])
 
     @classmethod
     def parse(cls, fileobj):
@@ -28,20 +101,81 @@ class BaseStruct(object):
         
         return cls(fileobj, *cls._struct.unpack(data))
     
-    def raw(self):
-        return self._struct.pack(*self._data.values())
+    @classmethod
+    def parse_many(cls, source, count, offset=0, view=False):
+        '''parses count consecutive records with a single read, source is an
+        opened file or file-like-object or a string/buffer in which case the
+        records start at offset. With view=True a StructView is returned
+        which only creates the records when they are accessed'''
+        size = cls._struct.size*count
+        
+        fileobj = None
+        if hasattr(source, 'read'):
+            fileobj = source
+            source = source.read(size)
+            offset = 0
+        
+        enforce(len(source) - offset >= size, ValueError,
+                'incorrect amount of data read, file to small?')
+        
+        if view:
+            return StructView(cls, source, offset, count)
+        
+        if count == 0:
+            return []
+        
+        step = len(cls._struct.unpack('\0'*cls._struct.size))
+        values = Struct(cls._struct.format[0] + cls._struct.format[1:]*count) \
+                    .unpack_from(source, offset)
+        
+        if not isinstance(fileobj, (file, BufferedIOBase)):
+            fileobj = None
+        
+        if not cls.__init__.im_func is BaseStruct.__init__.im_func:
+            args = (fileobj,) if fileobj else ()
+            return [cls(*(args + values[i:i+step]))
+                    for i in xrange(0, len(values), step)]
+        
+        # __init__ isn't overwritten, the records can be filled directly
+        records = list()
+        set_values = cls._set_values
+        for i in xrange(0, len(values), step):
+            record = object.__new__(cls)
+            record._fileobj = fileobj
+            set_values(record, *values[i:i+step])
+            records.append(record)
+        
+        return records
     
-    def __getattr__(self, name):
-        if name in self._fields:
-            return self._data[name]
-        else:
-            raise AttributeError, name
+    @classmethod
+    def dtype(cls):
+        '''the numpy dtype matching _struct, field names are taken from
+        _fields'''
+        return _dtype(cls._struct.format, cls._fields)
+    
+    @classmethod
+    def parse_array(cls, source, count, offset=0):
+        '''like parse_many but returns a numpy structured array, for a
+        string or buffer source the array is a read-only view into it'''
+        enforce(not _numpy() is None, ImportError, 'numpy is required')
         
-    def __setattr__(self, name, value):
-        if name in self._fields:
-            self._data[name] = value
-        else:
-            object.__setattr__(self, name, value)
+        if hasattr(source, 'read'):
+            source = source.read(cls._struct.size*count)
+            offset = 0
+        
+        enforce(len(source) - offset >= cls._struct.size*count, ValueError,
+                'incorrect amount of data read, file to small?')
+        
+        return numpy.frombuffer(source, cls.dtype(), count, offset)
+    
+    @property
+    def _data(self):
+        '''the fields and their values, changes to the returned dict are not
+        written back'''
+        return OrderedDict(izip(self._fields, self._values(self)))
+    
+    def raw(self):
+        return self._struct.pack(*self._values(self))
 
     def __cmp__(self, other):
         if isinstance(other, BaseStruct):
@@ -59,6 +193,115 @@ class BaseStruct(object):
                                          for field in self._fields))
     
     
+_DTYPES = {'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+           'l': 'i4', 'L': 'u4', 'q': 'i8', 'Q': 'u8', 'f': 'f4', 'd': 'f8'}
+
+def _dtype(format, fields):
+    enforce(format[0] in '<>!=', ValueError, 'only standard sizes are supported')
+    order = '>' if format[0] in '>!' else '<'
+    
+    types = list()
+    for count, code in re.findall(r'(\d*)([a-zA-Z])', format[1:]):
+        if code == 's':
+            types.append('S' + (count or '1'))
+        else:
+            types.extend([order + _DTYPES[code]] * int(count or 1))
+    
+    return _numpy().dtype(zip(fields, types))
+
+
+class StructView(object):
+    '''read-only sequence of records in a string or buffer, the records are
+    unpacked on access'''
+    def __init__(self, cls, data, offset, count):
+        self.cls = cls
+        self.data = data
+        self.offset = offset
+        self.count = count
+    
+    def __len__(self):
+        return self.count
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in xrange(*item.indices(self.count))]
+        
+        if item < 0:
+            item += self.count
+        if not 0 <= item < self.count:
+            raise IndexError('index out of range')
+        
+        return self.cls(*self.cls._struct.unpack_from(self.data,
+                        self.offset + item*self.cls._struct.size))
+    
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield self[i]
+    
+    def raw(self):
+        return str(buffer(self.data, self.offset, self.count*self.cls._struct.size))
+
+
 def enforce(boolean, exception, *args, **kwargs):
     if not boolean:
-        raise exception(*args, **kwargs)
\ No newline at end of file
+        raise exception(*args, **kwargs)
+
+def copy_range(src, dst, offset, size, chunk_size=1 << 20):
+    '''copies size bytes at offset of the file src to the current position
+    of the file dst, inside the kernel if os.copy_file_range is available,
+    otherwise in chunks of chunk_size'''
+    position = dst.tell()
+    copied = 0
+    
+    if hasattr(os, 'copy_file_range'):
+        dst.flush()
+        try:
+            while copied < size:
+                count = os.copy_file_range(src.fileno(), dst.fileno(),
+                                           size - copied, offset + copied,
+                                           position + copied)
+                if count == 0:
+                    break
+                copied += count
+        except (OSError, ValueError):
+            pass
+        dst.seek(position + copied, SEEK_SET)
+    
+    src.seek(offset + copied, SEEK_SET)
+    while copied < size:
+        data = src.read(min(chunk_size, size - copied))
+        enforce(data, ValueError, 'unexpected end of file')
+        
+        dst.write(data)
+        copied += len(data)
+
+def coalesce(ranges, gap=0, limit=None):
+    '''merges (offset, size) ranges which are at most gap bytes apart into
+    (offset, size, positions) spans ordered by offset, positions are the
+    positions of the merged ranges in ranges, a span only grows beyond
+    limit bytes if a single range is larger'''
+    spans = list()
+    for position in sorted(xrange(len(ranges)), key=lambda i: ranges[i][0]):
+        offset, size = ranges[position]
+        
+        if spans:
+            start, end, positions = spans[-1]
+            if offset - end <= gap and (limit is None or
+                                        max(end, offset + size) - start <= limit):
+                spans[-1] = (start, max(end, offset + size), positions)
+                positions.append(position)
+                continue
+        
+        spans.append((offset, offset + size, [position]))
+    
+    return [(start, end - start, positions) for start, end, positions in spans]
+
+def advise(fileobj, offset, size):
+    '''hints that the range of fileobj will be read soon, if
+    os.posix_fadvise is available'''
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fileobj.fileno(), offset, size,
+                             os.POSIX_FADV_WILLNEED)
+        except (OSError, ValueError):
+            pass